@@ -0,0 +1 @@
+from src.asgi import app
@@ -0,0 +1,91 @@
+"""Books the same popular slots from many threads at once through POST /rdv
+and checks that no slot ended up with more than SLOT_CAPACITY RDVs.
+
+Usage: python -m benchmarks.booking_stress [--threads N] [--bookings N]
+                                            [--slots N]
+
+Runs against a fresh SQLite file unless DATABASE_URL points to another
+database (e.g. a local MySQL), which must then be empty.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--bookings", type=int, default=50,
+                        help="bookings attempted by every thread")
+    parser.add_argument("--slots", type=int, default=4,
+                        help="number of contended slots")
+    args = parser.parse_args()
+
+    if "DATABASE_URL" not in os.environ:
+        db_file = os.path.join(tempfile.mkdtemp(), "stress.sqlite")
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_file}"
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key-benchmark-secret")
+
+    from api import app
+    from src.models.models import db, Utilisateur, RDV
+    from src.models.init import SLOT_DURATION, SLOT_CAPACITY
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(Utilisateur(nom="stress", sexe="F",
+                                   dateNaissance=date(2000, 1, 1),
+                                   email="stress@medico.bi",
+                                   province="Bujumbura", commune="Mukaza",
+                                   password="0" * 64))
+        db.session.commit()
+    client = app.test_client()
+    client.post("/hopital", json={"nom": "Stress", "services": ["stress"]})
+
+    first_slot = datetime.combine(date.today() + timedelta(days=1),
+                                  datetime.min.time()).replace(hour=8)
+    slots = [first_slot + n * SLOT_DURATION for n in range(args.slots)]
+    statuses = Counter()
+    lock = threading.Lock()
+
+    def book(worker: int):
+        client = app.test_client()
+        for n in range(args.bookings):
+            dateTime = slots[(worker + n) % len(slots)]
+            response = client.post("/rdv", json={
+                "nom": f"patient{worker}-{n}", "sexe": "F",
+                "dateTime": dateTime.isoformat(), "hopital": "Stress",
+                "service": "stress", "reference_id": 1})
+            with lock:
+                statuses[response.status_code] += 1
+
+    threads = [threading.Thread(target=book, args=(worker,))
+               for worker in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        booked = Counter(db.session.execute(
+            db.select(RDV.dateTime)).scalars())
+    overbooked = {slot: count for slot, count in booked.items()
+                  if count > SLOT_CAPACITY}
+    attempts = args.threads * args.bookings
+    print(f"attempts={attempts} elapsed={elapsed:.2f}s "
+          f"throughput={attempts / elapsed:.1f} req/s")
+    print(f"statuses={dict(sorted(statuses.items()))} "
+          f"booked={sum(booked.values())} "
+          f"expected={len(slots) * SLOT_CAPACITY}")
+    print(f"double bookings={len(overbooked)}")
+    if overbooked:
+        raise SystemExit(f"Overbooked slots: {overbooked}")
+
+
+if __name__ == "__main__":
+    main()
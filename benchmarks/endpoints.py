@@ -0,0 +1,251 @@
+"""Measures throughput and latency percentiles of the main endpoints, served
+over HTTP by the app of api.py on a seeded SQLite file.
+
+Usage: python -m benchmarks.endpoints [--users N] [--hopitaux N] [--rdvs N]
+                                      [--requests N] [--concurrency N]
+                                      [--scenarios NAME ...]
+                                      [--output FILE] [--baseline FILE]
+
+Results are written as JSON (to stdout unless --output is given), one entry
+per scenario. With --baseline, the relative change of the throughput and
+the p95 against a previous results file is printed to stderr.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+import http.client
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+SERVICES = 20
+RDV_START = datetime(2030, 1, 1, 8)
+
+
+def seed(db, models, users: int, hopitaux: int, rdvs: int):
+    """Fills an empty database with `users` users, `hopitaux` hospitals
+    offering every service and `rdvs` RDVs spread over the users"""
+    Utilisateur, Service, Hopital, RDV, service_hopital = models
+    from src.functions import hash_password
+    password = hash_password("password")
+    db.session.execute(db.insert(Utilisateur), [
+        {"nom": f"user{i}", "sexe": "F", "dateNaissance": date(2000, 1, 1),
+         "email": f"user{i}@medico.bi", "numeroTelephone": f"+257{i:08d}",
+         "province": "Bujumbura", "commune": "Mukaza", "password": password}
+        for i in range(users)])
+    db.session.execute(db.insert(Service), [
+        {"nom": f"service{i}"} for i in range(SERVICES)])
+    db.session.execute(db.insert(Hopital), [
+        {"nom": f"hopital{i}", "adresse": "Bujumbura"}
+        for i in range(hopitaux)])
+    db.session.execute(db.insert(service_hopital), [
+        {"hopital_id": h + 1, "service_id": s + 1}
+        for h in range(hopitaux) for s in range(SERVICES)])
+    for start in range(0, rdvs, 10000):
+        db.session.execute(db.insert(RDV), [
+            {"nom": f"patient{i}", "sexe": "F",
+             "dateTime": RDV_START - timedelta(hours=i),
+             "hopital_id": i % hopitaux + 1, "service_id": i % SERVICES + 1,
+             "utilisateur_id": i % users + 1}
+            for i in range(start, min(start + 10000, rdvs))])
+    db.session.commit()
+
+
+def scenarios(users: int, hopitaux: int, slot: timedelta) -> dict:
+    """Request of every scenario, built from the request number so that
+    writes never collide"""
+    def login(i):
+        return "GET", "/user?" + urlencode(
+                {"email": f"user{i % users}@medico.bi",
+                 "password": "password"}), None, 200
+
+    def register(i):
+        return "POST", "/user", {
+                "nom": f"new{i}", "sexe": "M", "dateNaissance": "1990-01-01",
+                "email": f"new{i}@medico.bi",
+                "numeroTelephone": f"+258{i:08d}", "province": "Gitega",
+                "commune": "Gitega", "password": "0" * 64}, 201
+
+    def hopital_get(i):
+        return "GET", "/hopital", None, 200
+
+    def hopital_post(i):
+        return "POST", "/hopital", {
+                "nom": f"nouvel hopital{i}", "adresse": "Ngozi",
+                "services": [f"service{i % SERVICES}", f"nouveau{i}"]}, 201
+
+    def rdv_get(i):
+        return "GET", f"/rdv?id_user={i % users + 1}", None, 200
+
+    def rdv_post(i):
+        return "POST", "/rdv", {
+                "nom": f"patient{i}", "sexe": "F",
+                "dateTime": (RDV_START + i * slot).isoformat(),
+                "hopital": f"hopital{i % hopitaux}",
+                "service": f"service{i % SERVICES}",
+                "reference_id": i % users + 1}, 201
+
+    return {"login": login, "register": register,
+            "hopital_get": hopital_get, "hopital_post": hopital_post,
+            "rdv_get": rdv_get, "rdv_post": rdv_post}
+
+
+def run(port: int, build, numbers: range, concurrency: int) -> dict:
+    """Sends the requests of `numbers` from `concurrency` threads, each
+    keeping its own connection"""
+    local = threading.local()
+
+    def send(i):
+        method, path, body, expected = build(i)
+        if not hasattr(local, "connection"):
+            local.connection = http.client.HTTPConnection("127.0.0.1", port)
+        headers = {"Content-Type": "application/json"} if body else {}
+        start = time.perf_counter()
+        try:
+            local.connection.request(method, path, json.dumps(body)
+                                     if body else None, headers)
+            response = local.connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            local.connection.close()
+            del local.connection
+            return time.perf_counter() - start, 0, False
+        duration = time.perf_counter() - start
+        if response.will_close:
+            local.connection.close()
+            del local.connection
+        return duration, response.status, response.status == expected
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        start = time.perf_counter()
+        outcomes = list(executor.map(send, numbers))
+        elapsed = time.perf_counter() - start
+
+    durations = [duration for duration, _, _ in outcomes]
+    statuses: dict = {}
+    for _, status, _ in outcomes:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    quantiles = statistics.quantiles(durations, n=100) \
+        if len(durations) > 1 else durations * 99
+    return {"requests": len(outcomes),
+            "concurrency": concurrency,
+            "errors": sum(1 for _, _, ok in outcomes if not ok),
+            "statuses": statuses,
+            "elapsed_s": round(elapsed, 4),
+            "throughput_rps": round(len(outcomes) / elapsed, 2),
+            "mean_ms": round(statistics.mean(durations) * 1000, 3),
+            "p50_ms": round(quantiles[49] * 1000, 3),
+            "p95_ms": round(quantiles[94] * 1000, 3),
+            "p99_ms": round(quantiles[98] * 1000, 3)}
+
+
+def revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline_file: str):
+    with open(baseline_file) as f:
+        baseline = json.load(f)["results"]
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        print(f"{name}: "
+              f"throughput {before['throughput_rps']} -> "
+              f"{result['throughput_rps']} req/s "
+              f"({result['throughput_rps'] / before['throughput_rps'] - 1:+.1%})"
+              f", p95 {before['p95_ms']} -> {result['p95_ms']} ms "
+              f"({result['p95_ms'] / before['p95_ms'] - 1:+.1%})",
+              file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--hopitaux", type=int, default=100)
+    parser.add_argument("--rdvs", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=2000,
+                        help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=100,
+                        help="unmeasured requests sent first per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--scenarios", nargs="+",
+                        choices=list(scenarios(1, 1, timedelta())))
+    parser.add_argument("--output", help="JSON results file")
+    parser.add_argument("--baseline", help="previous JSON results file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = \
+        f"sqlite:///{os.path.join(workdir, 'endpoints.sqlite')}"
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key-benchmark-secret")
+    os.environ.setdefault("LOG_FILE", os.path.join(workdir, "endpoints.log"))
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    from werkzeug.serving import make_server
+    from api import app
+    from src.models.init import SLOT_DURATION
+    from src.models.models import db, Utilisateur, Service, Hopital, RDV, \
+        service_hopital
+
+    with app.app_context():
+        db.create_all()
+        seed(db, (Utilisateur, Service, Hopital, RDV, service_hopital),
+             args.users, args.hopitaux, args.rdvs)
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = {}
+    builders = scenarios(args.users, args.hopitaux, SLOT_DURATION)
+    for name in args.scenarios or builders:
+        build = builders[name]
+        # Warmup requests take numbers after the measured ones, so that
+        # writes stay unique across both
+        run(server.server_port, build,
+            range(args.requests, args.requests + args.warmup),
+            args.concurrency)
+        results[name] = run(server.server_port, build, range(args.requests),
+                            args.concurrency)
+        print(f"{name}: {results[name]['throughput_rps']} req/s "
+              f"p50={results[name]['p50_ms']}ms "
+              f"p95={results[name]['p95_ms']}ms "
+              f"p99={results[name]['p99_ms']}ms "
+              f"errors={results[name]['errors']}", file=sys.stderr)
+    server.shutdown()
+
+    report = {"meta": {"revision": revision(),
+                       "date": datetime.now().isoformat(timespec="seconds"),
+                       "python": platform.python_version(),
+                       "platform": platform.platform(),
+                       "database": "sqlite",
+                       "users": args.users, "hopitaux": args.hopitaux,
+                       "rdvs": args.rdvs, "requests": args.requests,
+                       "warmup": args.warmup,
+                       "concurrency": args.concurrency},
+              "results": results}
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
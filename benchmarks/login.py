@@ -0,0 +1,71 @@
+"""Measures the latency of GET /user (login) against a seeded SQLite file.
+
+Usage: python -m benchmarks.login [--users N] [--requests N]
+"""
+import argparse
+from datetime import date
+import os
+import statistics
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(), "login.sqlite")
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_file}"
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key-benchmark-secret")
+
+    from sqlalchemy import event
+    from api import app
+    from src.models.models import db, Utilisateur, Service
+    from src.functions import hash_password
+
+    with app.app_context():
+        db.create_all()
+        password = hash_password("password")
+        db.session.execute(db.insert(Utilisateur), [
+            {"nom": f"user{i}", "sexe": "M", "dateNaissance": date(2000, 1, 1),
+             "email": f"user{i}@medico.bi",
+             "numeroTelephone": f"+257{i:08d}", "province": "Bujumbura",
+             "commune": "Mukaza", "password": password}
+            for i in range(args.users)])
+        db.session.execute(db.insert(Service), [
+            {"nom": f"service{i}"} for i in range(50)])
+        db.session.commit()
+
+        statements = []
+        event.listen(db.engine, "before_cursor_execute",
+                     lambda *_: statements.append(1))
+
+    client = app.test_client()
+    timings = {}
+    for identifier in ("email", "numeroTelephone"):
+        durations = []
+        statements.clear()
+        for i in range(args.requests):
+            n = i % args.users
+            value = f"user{n}@medico.bi" if identifier == "email" \
+                else f"+257{n:08d}"
+            start = time.perf_counter()
+            response = client.get("/user", query_string={
+                identifier: value, "password": "password"})
+            durations.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.get_json()
+        timings[identifier] = (durations, len(statements) / args.requests)
+
+    for identifier, (durations, per_request) in timings.items():
+        quantiles = statistics.quantiles(durations, n=100)
+        print(f"login by {identifier}: "
+              f"mean={statistics.mean(durations) * 1000:.3f}ms "
+              f"p50={quantiles[49] * 1000:.3f}ms "
+              f"p95={quantiles[94] * 1000:.3f}ms "
+              f"statements/request={per_request:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Checks that none of the statements issued by the UtilisateurResource,
+Hopitals and RDVs resource methods falls back to a full table scan.
+
+Usage: python -m benchmarks.query_plans [--verbose]
+
+Every statement of a set of typical requests is run through EXPLAIN (EXPLAIN
+QUERY PLAN on SQLite). Only the reference tables loaded whole by the caches
+(ALLOWED_SCANS) may be scanned. Exits with status 1 when another table is.
+
+Runs against a fresh SQLite file unless DATABASE_URL points to another
+database (e.g. a local MySQL), which must then be empty.
+"""
+import argparse
+from datetime import datetime
+import os
+import sys
+import tempfile
+
+# hopital and service are read whole by the services catalog and the
+# GET /hopital snapshot, on purpose
+ALLOWED_SCANS = {"hopital", "service"}
+EXPLAINABLE = ("SELECT", "UPDATE", "DELETE")
+
+
+def explain(connection, statement: str, parameters) -> list[tuple]:
+    sqlite = connection.dialect.name == "sqlite"
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(("EXPLAIN QUERY PLAN " if sqlite else "EXPLAIN ")
+                       + statement, parameters)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def full_scans(dialect: str, plan: list[dict]) -> set[str]:
+    """Tables of `plan` read entirely, table or index"""
+    scanned = set()
+    for step in plan:
+        if dialect == "sqlite":
+            # e.g. "SCAN rdv" or "SCAN rdv USING INDEX ix_..."
+            words = step["detail"].split()
+            if words[0] == "SCAN" and words[1] != "CONSTANT":
+                scanned.add(words[1])
+        elif step.get("type") in ("ALL", "index") and step.get("table"):
+            scanned.add(step["table"])
+    return scanned
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--verbose", action="store_true",
+                        help="print the plan of every statement")
+    args = parser.parse_args()
+
+    if "DATABASE_URL" not in os.environ:
+        db_file = os.path.join(tempfile.mkdtemp(), "plans.sqlite")
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_file}"
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key-benchmark-secret")
+
+    from flask import has_request_context
+    from sqlalchemy import event
+    from api import app
+    from src.functions import resource_method
+    from src.models.models import db, Utilisateur, Service, Hopital, RDV, \
+        service_hopital
+    from benchmarks.endpoints import seed
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and not executemany and \
+                statement.lstrip()[:6].upper() in EXPLAINABLE:
+            statements.append((resource_method(), statement, parameters))
+
+    with app.app_context():
+        db.create_all()
+        # Enough rows for the MySQL optimizer to prefer the indexes
+        seed(db, (Utilisateur, Service, Hopital, RDV, service_hopital),
+             users=2000, hopitaux=50, rdvs=20000)
+        if db.engine.dialect.name == "mysql":
+            for table in db.metadata.tables:
+                db.session.execute(db.text(f"ANALYZE TABLE {table}"))
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+
+    client = app.test_client()
+    client.get("/user", query_string={"email": "user7@medico.bi",
+                                      "password": "password"})
+    client.get("/user", query_string={"numeroTelephone": "+25700000007",
+                                      "password": "password"})
+    client.post("/user", json={
+        "nom": "nouveau", "sexe": "F", "dateNaissance": "1990-01-01",
+        "email": "nouveau@medico.bi", "numeroTelephone": "+25799999999",
+        "province": "Gitega", "commune": "Gitega", "password": "0" * 64})
+    client.get("/hopital")
+    client.post("/hopital", json={"nom": "nouvel hopital",
+                                  "services": ["service1", "nouveau"]})
+    page = client.get("/rdv", query_string={"id_user": 7, "limit": 2})
+    client.get("/rdv", query_string={"id_user": 7, "limit": 2,
+                                     "cursor": page.get_json()["next_cursor"]})
+    client.get("/rdv", query_string={"id_user": 7,
+                                     "from": "2029-01-01T00:00:00",
+                                     "to": "2030-01-01T00:00:00"})
+    client.post("/rdv", json={
+        "nom": "patient", "sexe": "F",
+        "dateTime": datetime(2031, 1, 6, 9).isoformat(),
+        "hopital": "hopital3", "service": "service3", "reference_id": 7})
+    event.remove(engine, "before_cursor_execute", record)
+
+    failures = []
+    with engine.connect() as connection:
+        for method, statement, parameters in statements:
+            plan = explain(connection, statement, parameters)
+            scanned = full_scans(connection.dialect.name, plan) \
+                - ALLOWED_SCANS
+            if scanned:
+                failures.append((method, statement, scanned))
+            if args.verbose or scanned:
+                print(f"{'FULL SCAN' if scanned else 'ok'} {method}: "
+                      f"{' '.join(statement.split())}")
+                for step in plan:
+                    print(f"    {step}")
+
+    print(f"{len(statements)} statements explained, "
+          f"{len(failures)} with full scans")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
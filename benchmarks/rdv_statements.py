@@ -0,0 +1,113 @@
+"""Checks that GET /rdv issues as many statements for a user with a single
+RDV as for a user with many, i.e. that the hopital and service of the RDVs
+are not loaded row by row (N+1), and that an unknown hopital name costs
+GET /disponibilite a single lookup instead of a reload of the id map.
+
+Usage: python -m benchmarks.rdv_statements [--rdvs N] [--misses N]
+
+Every statement is counted with a before_cursor_execute listener on the
+engine. Exits with status 1 when the two counts of GET /rdv differ, or when
+a miss issues more than one statement or invalidates the id map.
+
+Runs against a fresh SQLite file unless DATABASE_URL points to another
+database, which must then be empty.
+"""
+import argparse
+from datetime import timedelta
+import os
+import sys
+import tempfile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rdvs", type=int, default=50,
+                        help="RDVs of the second user (a single page of them "
+                             "up to RDV_MAX_PAGE_SIZE)")
+    parser.add_argument("--misses", type=int, default=20,
+                        help="GET /disponibilite with unknown hopitaux")
+    args = parser.parse_args()
+
+    if "DATABASE_URL" not in os.environ:
+        db_file = os.path.join(tempfile.mkdtemp(), "statements.sqlite")
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_file}"
+    os.environ.setdefault("SECRET_KEY", "benchmark-secret-key-benchmark-secret")
+
+    from flask import has_request_context
+    from sqlalchemy import event
+    from api import app
+    from src.models.models import db, Utilisateur, Service, Hopital, RDV, \
+        service_hopital
+    from src.models.init import RDV_MAX_PAGE_SIZE
+    from src.resources import ids_map
+    from benchmarks.endpoints import seed, RDV_START, SERVICES
+
+    hopitaux = 5
+    with app.app_context():
+        db.create_all()
+        seed(db, (Utilisateur, Service, Hopital, RDV, service_hopital),
+             users=2, hopitaux=hopitaux, rdvs=0)
+        # User 1 has a single RDV, user 2 has --rdvs of them spread over
+        # every hopital and service
+        db.session.execute(db.insert(RDV), [
+            {"nom": "patient", "sexe": "F", "dateTime": RDV_START,
+             "hopital_id": 1, "service_id": 1, "utilisateur_id": 1}] + [
+            {"nom": f"patient{i}", "sexe": "F",
+             "dateTime": RDV_START + timedelta(hours=i),
+             "hopital_id": i % hopitaux + 1, "service_id": i % SERVICES + 1,
+             "utilisateur_id": 2}
+            for i in range(args.rdvs)])
+        db.session.commit()
+        engine = db.engine
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            statements.append(statement)
+
+    client = app.test_client()
+    counts = {}
+    event.listen(engine, "before_cursor_execute", record)
+    for user, rdvs in ((1, 1), (2, args.rdvs)):
+        statements.clear()
+        response = client.get("/rdv", query_string={
+            "id_user": user, "limit": RDV_MAX_PAGE_SIZE})
+        if response.status_code != 200 or len(response.get_json()["output"]) \
+                != min(rdvs, RDV_MAX_PAGE_SIZE):
+            print(f"GET /rdv of user {user} failed: {response.status_code} "
+                  f"{response.get_data(as_text=True)[:200]}")
+            sys.exit(1)
+        counts[rdvs] = len(statements)
+        print(f"{rdvs} RDV(s): {len(statements)} statement(s)")
+
+    # Loads the id map, then only asks for names missing from it
+    query = {"hopital": "hopital0", "service": "service0",
+             "date": RDV_START.date().isoformat()}
+    client.get("/disponibilite", query_string=query)
+    version = ids_map.version
+    statements.clear()
+    for i in range(args.misses):
+        response = client.get("/disponibilite",
+                              query_string=dict(query, hopital=f"nope{i}"))
+        if response.status_code != 404:
+            print(f"GET /disponibilite of nope{i} answered "
+                  f"{response.status_code} instead of 404")
+            sys.exit(1)
+    misses = len(statements)
+    print(f"{args.misses} miss(es): {misses} statement(s), "
+          f"{ids_map.version - version} id map invalidation(s)")
+    event.remove(engine, "before_cursor_execute", record)
+
+    if counts[1] != counts[args.rdvs]:
+        print(f"GET /rdv issues {counts[args.rdvs] - counts[1]} more "
+              f"statements for {args.rdvs} RDVs than for 1")
+        sys.exit(1)
+    if misses > args.misses or ids_map.version != version:
+        print("Unknown hopitaux reload the id map instead of a single "
+              "lookup each")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
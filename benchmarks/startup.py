@@ -0,0 +1,63 @@
+"""Measures how long a fresh worker process takes to import the app, build
+it with create_app and serve its first request.
+
+Usage: python -m benchmarks.startup [--runs N]
+
+Every run is a new interpreter, against a fresh SQLite file unless
+DATABASE_URL points to another database.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+WORKER = """
+import json, time
+start = time.perf_counter()
+from src.app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+app.test_client().get("/")
+served = time.perf_counter()
+print(json.dumps({"import": imported - start, "create_app": created - imported,
+                  "first_request": served - created}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    workdir = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPATH=root)
+    env.setdefault("DATABASE_URL",
+                   f"sqlite:///{os.path.join(workdir, 'startup.sqlite')}")
+    env.setdefault("SECRET_KEY", "benchmark-secret-key-benchmark-secret")
+    env.setdefault("LOG_FILE", os.path.join(workdir, "startup.log"))
+
+    timings: dict[str, list[float]] = {}
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", WORKER], env=env,
+                                cwd=workdir, capture_output=True, text=True,
+                                check=True).stdout
+        total = time.perf_counter() - start
+        for phase, duration in {**json.loads(output),
+                                "process": total}.items():
+            timings.setdefault(phase, []).append(duration)
+
+    for phase, durations in timings.items():
+        print(f"{phase}: mean={statistics.mean(durations) * 1000:.1f}ms "
+              f"median={statistics.median(durations) * 1000:.1f}ms "
+              f"min={min(durations) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
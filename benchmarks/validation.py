@@ -0,0 +1,49 @@
+"""Compares the cost of validating typical payloads with a schema built for
+every request against a schema built once at import.
+
+Usage: python -m benchmarks.validation [--number N]
+"""
+import argparse
+import os
+import tempfile
+import timeit
+
+PAYLOADS = {
+    "UtilisateurPOSTSchema": {
+        "nom": "Irakoze", "sexe": "F", "dateNaissance": "1995-04-12",
+        "email": "irakoze@medico.bi", "numeroTelephone": "+25779000000",
+        "province": "Bujumbura", "commune": "Mukaza", "password": "0" * 64},
+    "HopitalPOSTSchema": {
+        "nom": "Hopital Roi Khaled", "adresse": "Bujumbura",
+        "services": ["cardiologie", "pediatrie", "dermatologie"]},
+    "RDVPOSTSchema": {
+        "nom": "Irakoze", "sexe": "F", "contact": "+25779000000",
+        "province": "Bujumbura", "commune": "Mukaza",
+        "dateTime": "2025-08-01T09:30:00", "hopital": "Hopital Roi Khaled",
+        "service": "cardiologie", "reference_id": 1},
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(), "validation.sqlite")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{db_file}")
+    from src import resources
+
+    for name, payload in PAYLOADS.items():
+        schema_class = getattr(resources, name)
+        schema = schema_class()
+        per_request = timeit.timeit(lambda: schema_class().load(payload),
+                                    number=args.number) / args.number
+        cached = timeit.timeit(lambda: schema.load(payload),
+                               number=args.number) / args.number
+        print(f"{name}: per request={per_request * 1e6:.1f}us "
+              f"cached={cached * 1e6:.1f}us "
+              f"saved={(1 - cached / per_request) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
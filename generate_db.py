@@ -0,0 +1,150 @@
+"""Fills an empty database with a large synthetic dataset, the same for a
+given seed, to test how the API scales.
+
+Usage: python generate_db.py [--users N] [--hopitaux N] [--services N]
+                             [--services-per-hopital N] [--rdvs N]
+                             [--seed N] [--until YYYY-MM-DD]
+                             [--batch-size N]
+
+Rows are generated lazily and written by one bulk INSERT per batch, through
+Core rather than the ORM. The RDVs all lie in the past, at slot starts in the
+opening hours of the HISTORY_DAYS days before --until (today by default),
+so they leave the future slots (table creneau) free. The same seed and
+--until always give the same rows.
+"""
+import argparse
+from datetime import date, datetime, timedelta
+from itertools import islice
+import random
+import sys
+import time
+
+from api import app
+from src.functions import hash_password
+from src.models.init import SLOT_DURATION, OPENING_TIME, CLOSING_TIME
+from src.models.models import db, Utilisateur, Service, Hopital, RDV, \
+        service_hopital
+
+PROVINCES = {
+        "Bujumbura": ["Mukaza", "Ntahangwa", "Muha"],
+        "Gitega": ["Gitega", "Giheta", "Makebuko"],
+        "Ngozi": ["Ngozi", "Kiremba", "Marangara"],
+        "Kirundo": ["Kirundo", "Busoni", "Ntega"],
+        "Rumonge": ["Rumonge", "Bugarama", "Muhuta"],
+        }
+NOMS = ["Irakoze", "Ndayishimiye", "Niyonzima", "Hakizimana", "Uwimana",
+        "Nshimirimana", "Bizimana", "Ndikumana", "Kaneza", "Iteka"]
+HISTORY_DAYS = 3 * 365
+
+
+def users(rng: random.Random, count: int):
+    for i in range(count):
+        province = rng.choice(list(PROVINCES))
+        yield {"id": i + 1,
+               "nom": f"{rng.choice(NOMS)} {i}",
+               "sexe": rng.choice("MF"),
+               "dateNaissance": date(1940, 1, 1)
+               + timedelta(days=rng.randrange(80 * 365)),
+               "email": f"user{i}@medico.bi",
+               "numeroTelephone": f"+257{i:08d}",
+               "province": province,
+               "commune": rng.choice(PROVINCES[province]),
+               "password": hash_password(f"password{i}")}
+
+
+def links(rng: random.Random, hopitaux: int, services: int, per_hopital: int):
+    """service_hopital rows, with the services of every hospital"""
+    offered = {}
+    for hopital_id in range(1, hopitaux + 1):
+        offered[hopital_id] = sorted(rng.sample(range(1, services + 1),
+                                                min(per_hopital, services)))
+    rows = [{"hopital_id": hopital_id, "service_id": service_id}
+            for hopital_id, service_ids in offered.items()
+            for service_id in service_ids]
+    return rows, offered
+
+
+def rdvs(rng: random.Random, count: int, users: int, offered: dict,
+         until: date):
+    first_day = until - timedelta(days=HISTORY_DAYS)
+    opening = datetime.combine(date.min, OPENING_TIME)
+    slots = max(1, (datetime.combine(date.min, CLOSING_TIME) - opening)
+                // SLOT_DURATION)
+    hopital_ids = list(offered)
+    for i in range(count):
+        hopital_id = rng.choice(hopital_ids)
+        province = rng.choice(list(PROVINCES))
+        yield {"id": i + 1,
+               "nom": f"{rng.choice(NOMS)} {i}",
+               "sexe": rng.choice("MF"),
+               "contact": f"+257{rng.randrange(10 ** 8):08d}",
+               "province": province,
+               "commune": rng.choice(PROVINCES[province]),
+               "dateTime": datetime.combine(
+                   first_day + timedelta(days=rng.randrange(HISTORY_DAYS)),
+                   OPENING_TIME) + rng.randrange(slots) * SLOT_DURATION,
+               "hopital_id": hopital_id,
+               "service_id": rng.choice(offered[hopital_id]),
+               "utilisateur_id": rng.randrange(users) + 1}
+
+
+def insert(connection, table, rows, batch_size: int):
+    """Writes the `rows` iterable by batches of `batch_size` rows"""
+    name = getattr(table, "__tablename__", getattr(table, "name", table))
+    start = time.perf_counter()
+    total = 0
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        connection.execute(db.insert(table), batch)
+        connection.commit()
+        total += len(batch)
+        elapsed = time.perf_counter() - start
+        print(f"\r{name}: {total} rows, {total / elapsed:.0f} rows/s",
+              end="", file=sys.stderr)
+    print(file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--hopitaux", type=int, default=2000)
+    parser.add_argument("--services", type=int, default=200)
+    parser.add_argument("--services-per-hopital", type=int, default=15)
+    parser.add_argument("--rdvs", type=int, default=5000000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--until", type=date.fromisoformat,
+                        default=date.today())
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        for model in (Utilisateur, Service, Hopital, RDV):
+            if db.session.execute(db.select(model.id).limit(1)).first():
+                raise SystemExit(f"Table {model.__tablename__} is not empty")
+        db.session.remove()
+
+        rng = random.Random(args.seed)
+        link_rows, offered = links(rng, args.hopitaux, args.services,
+                                   args.services_per_hopital)
+        start = time.perf_counter()
+        with db.engine.connect() as connection:
+            insert(connection, Utilisateur, users(rng, args.users),
+                   args.batch_size)
+            insert(connection, Service,
+                   ({"id": i + 1, "nom": f"service{i}"}
+                    for i in range(args.services)), args.batch_size)
+            insert(connection, Hopital,
+                   ({"id": i + 1, "nom": f"hopital{i}",
+                     "adresse": rng.choice(list(PROVINCES))}
+                    for i in range(args.hopitaux)), args.batch_size)
+            insert(connection, service_hopital, link_rows, args.batch_size)
+            insert(connection, RDV,
+                   rdvs(rng, args.rdvs, args.users, offered, args.until),
+                   args.batch_size)
+        print(f"Generated in {time.perf_counter() - start:.1f}s",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""added indexes on rdv foreign keys and keys on the association tables
+
+Revision ID: 7c3e9a1d5b60
+Revises: f2b96d4a5c18
+Create Date: 2025-07-18 10:21:37.418095
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3e9a1d5b60'
+down_revision = 'f2b96d4a5c18'
+branch_labels = None
+depends_on = None
+
+
+def deduplicate(table, columns):
+    """Removes the incomplete and duplicated rows of an association table,
+    which would prevent creating its primary key"""
+    op.execute(f"DELETE FROM {table} WHERE "
+               + " OR ".join(f"{column} IS NULL" for column in columns))
+    op.execute(f"CREATE TABLE {table}_dedup AS "
+               f"SELECT DISTINCT {', '.join(columns)} FROM {table}")
+    op.execute(f"DELETE FROM {table}")
+    op.execute(f"INSERT INTO {table} ({', '.join(columns)}) "
+               f"SELECT {', '.join(columns)} FROM {table}_dedup")
+    op.execute(f"DROP TABLE {table}_dedup")
+
+
+def index_names(table):
+    return {index['name'] for index in
+            sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    with op.batch_alter_table('rdv', schema=None) as batch_op:
+        batch_op.create_index('ix_rdv_hopital_id_service_id_dateTime', ['hopital_id', 'service_id', 'dateTime'], unique=False)
+        batch_op.create_index('ix_rdv_service_id', ['service_id'], unique=False)
+
+    deduplicate('service_hopital', ['hopital_id', 'service_id'])
+    with op.batch_alter_table('service_hopital', schema=None) as batch_op:
+        batch_op.alter_column('hopital_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('service_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_primary_key('pk_service_hopital', ['hopital_id', 'service_id'])
+        batch_op.create_index('ix_service_hopital_service_id', ['service_id'], unique=False)
+        # Left by a previous downgrade, the primary key now serves it
+        if 'ix_service_hopital_hopital_id' in index_names('service_hopital'):
+            batch_op.drop_index('ix_service_hopital_hopital_id')
+
+    deduplicate('utilisateur_service_hopital', ['utilisateur_id', 'rdv_id'])
+    with op.batch_alter_table('utilisateur_service_hopital', schema=None) as batch_op:
+        batch_op.alter_column('utilisateur_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('rdv_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_primary_key('pk_utilisateur_service_hopital', ['utilisateur_id', 'rdv_id'])
+        batch_op.create_index('ix_utilisateur_service_hopital_rdv_id', ['rdv_id'], unique=False)
+        if 'ix_utilisateur_service_hopital_utilisateur_id' in index_names('utilisateur_service_hopital'):
+            batch_op.drop_index('ix_utilisateur_service_hopital_utilisateur_id')
+
+
+def downgrade():
+    # The foreign keys on the leading columns of the primary keys need an
+    # index of their own once the keys are gone (MySQL)
+    with op.batch_alter_table('utilisateur_service_hopital', schema=None) as batch_op:
+        batch_op.create_index('ix_utilisateur_service_hopital_utilisateur_id', ['utilisateur_id'], unique=False)
+        batch_op.drop_index('ix_utilisateur_service_hopital_rdv_id')
+        batch_op.drop_constraint('pk_utilisateur_service_hopital', type_='primary')
+        batch_op.alter_column('rdv_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.alter_column('utilisateur_id', existing_type=sa.Integer(), nullable=True)
+
+    with op.batch_alter_table('service_hopital', schema=None) as batch_op:
+        batch_op.create_index('ix_service_hopital_hopital_id', ['hopital_id'], unique=False)
+        batch_op.drop_index('ix_service_hopital_service_id')
+        batch_op.drop_constraint('pk_service_hopital', type_='primary')
+        batch_op.alter_column('service_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.alter_column('hopital_id', existing_type=sa.Integer(), nullable=True)
+
+    with op.batch_alter_table('rdv', schema=None) as batch_op:
+        batch_op.drop_index('ix_rdv_service_id')
+        batch_op.drop_index('ix_rdv_hopital_id_service_id_dateTime')
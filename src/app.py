@@ -0,0 +1,115 @@
+"""Application factory: importing the modules of src only reads the
+settings, the app, its extensions, logging and routes are all built by
+`create_app`."""
+import os
+import weakref
+
+import click
+from flask import Flask
+from flask_migrate import Migrate
+from flask_restful import Api
+
+from .logs import setup_logging
+from .metrics import TimedQueuePool, instrument
+from .models.init import logger, DATABASE_URL, REPLICA_DATABASE_URL, \
+        DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, \
+        DB_POOL_PRE_PING, SECRET_KEY, EXPIRES, LOG_FILE, LOG_LEVEL, \
+        LOG_SAMPLE_RATE, LOG_MAX_BYTES, LOG_BACKUPS, SQL_DEBUG, \
+        PROFILE_SECRET, PROFILE_SAMPLE_RATE, SLOT_DURATION
+from .models.models import db
+from .models.routing import remember_writes
+from .profiling import enable_profiling
+from .resources import jwt, reset_caches, rebuild_creneaux, Home, \
+        UtilisateurResource, Test, Hopitals, HopitalsBatch, RDVs, RDVsBatch, \
+        Disponibilites, Metrics
+from .sqldebug import enable_sql_debug
+
+log_listener = None
+
+
+def default_config() -> dict:
+    config = {
+            "SQLALCHEMY_DATABASE_URI": DATABASE_URL,
+            "SQLALCHEMY_ENGINE_OPTIONS": {
+                "pool_pre_ping": DB_POOL_PRE_PING,
+                "pool_recycle": DB_POOL_RECYCLE,
+                },
+            "JWT_SECRET_KEY": SECRET_KEY,
+            "JWT_ACCESS_TOKEN_EXPIRES": EXPIRES,
+            }
+    if REPLICA_DATABASE_URL:
+        config["SQLALCHEMY_BINDS"] = {"replica": REPLICA_DATABASE_URL}
+    if not DATABASE_URL.startswith("sqlite"):  # SQLite picks its own pool
+        config["SQLALCHEMY_ENGINE_OPTIONS"].update({
+            "poolclass": TimedQueuePool,
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            })
+    return config
+
+
+def dispose_engines(app: Flask):
+    """Drops the connections inherited from the parent process, without
+    closing them under its feet"""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+@click.command("rebuild-creneaux")
+def rebuild_creneaux_command():
+    """Recounts the creneau rows from the RDVs, after SLOT_MINUTES changed"""
+    slots = rebuild_creneaux()
+    click.echo(f"Rebuilt {slots} creneaux of {SLOT_DURATION}")
+
+
+def create_app(config: dict = None) -> Flask:
+    """Builds the app, with `config` overriding the settings read from the
+    environment"""
+    global log_listener
+    if log_listener is None:
+        log_listener = setup_logging(LOG_FILE, LOG_LEVEL, LOG_SAMPLE_RATE,
+                                     LOG_MAX_BYTES, LOG_BACKUPS)
+
+    app = Flask(__name__)
+    app.config.update(default_config())
+    app.config.update(config or {})
+
+    try:
+        db.init_app(app)
+        logger.info("Connected to database")
+        Migrate(app, db)
+        logger.info("Applied migrations...")
+    except Exception as e:
+        logger.error("Error encountered when connecting to database: %s", e)
+        raise e
+    jwt.init_app(app)
+    reset_caches()
+
+    instrument(app)
+    app.after_request(remember_writes)
+    if SQL_DEBUG:
+        enable_sql_debug(app)
+    if PROFILE_SECRET or PROFILE_SAMPLE_RATE:
+        enable_profiling(app)
+
+    app.cli.add_command(rebuild_creneaux_command)
+
+    api = Api(app)
+    api.add_resource(Home, "/")
+    api.add_resource(UtilisateurResource, "/user")
+    api.add_resource(Test, "/test")
+    api.add_resource(Hopitals, "/hopital")
+    api.add_resource(HopitalsBatch, "/hopital/batch")
+    api.add_resource(RDVs, "/rdv")
+    api.add_resource(RDVsBatch, "/rdv/batch")
+    api.add_resource(Disponibilites, "/disponibilite")
+    api.add_resource(Metrics, "/metrics")
+
+    # Prefork servers (e.g. gunicorn --preload) fork after the app is built:
+    # every worker must open its own connections
+    app_ref = weakref.ref(app)
+    os.register_at_fork(after_in_child=lambda: app_ref() is not None
+                        and dispose_engines(app_ref()))
+    return app
@@ -0,0 +1,399 @@
+"""Optional async serving mode of the /user, /hopital and /rdv endpoints.
+
+Every request runs on an async SQLAlchemy session, so a single process keeps
+many slow clients in flight without holding a thread each. It needs an
+async driver (aiomysql for MySQL, aiosqlite for a local SQLite file) and an
+ASGI server, e.g. `uvicorn asgi:app`, all listed in requirements-async.txt.
+
+Responses match the WSGI app's: the writes go through the same helpers of
+resources.py (run with run_sync), Idempotency-Key and the retries on
+transient errors behave the same, and the reads go to the replica under the
+same read-your-writes rule.
+"""
+from functools import wraps
+from json import loads
+import os
+import time
+from urllib.parse import parse_qs
+
+from flask_jwt_extended import create_access_token, decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+from marshmallow import ValidationError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from werkzeug.http import dump_cookie, parse_cookie
+
+from .app import create_app
+from .cache import AsyncTTLCache
+from .functions import hash_password, encode_cursor, decode_cursor
+from .idempotency import IN_PROGRESS, MISMATCH, idempotency_cle, \
+        fingerprint, lookup, acquire, release, log_release
+from .models.init import logger, ASYNC_DATABASE_URL, \
+        ASYNC_REPLICA_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, \
+        DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, \
+        SERVICES_CACHE_TTL, HOPITAUX_CACHE_TTL
+from .models.models import db, Utilisateur, Hopital, Service, RDV
+from .models.routing import WRITE_COOKIE, WRITE_COOKIE_MAX_AGE, \
+        wrote_recently
+from .resources import user_get_schema, user_post_schema, \
+        hopital_post_schema, rdv_get_schema, rdv_post_schema, \
+        select_hopitaux_services, build_hopitaux_snapshot, import_hopitaux, \
+        select_ids, register_user, book_rdv
+from .retry import async_db_retry, is_transient
+from .serialization import dumps
+
+engine_options = {"pool_pre_ping": DB_POOL_PRE_PING,
+                  "pool_recycle": DB_POOL_RECYCLE}
+if not ASYNC_DATABASE_URL.startswith("sqlite"):
+    engine_options.update({"pool_size": DB_POOL_SIZE,
+                           "max_overflow": DB_MAX_OVERFLOW,
+                           "pool_timeout": DB_POOL_TIMEOUT})
+engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options)
+Session = async_sessionmaker(engine, expire_on_commit=False)
+engines = [engine]
+ReplicaSession = None
+if ASYNC_REPLICA_DATABASE_URL:
+    replica_engine = create_async_engine(ASYNC_REPLICA_DATABASE_URL,
+                                         **engine_options)
+    ReplicaSession = async_sessionmaker(replica_engine,
+                                        expire_on_commit=False)
+    engines.append(replica_engine)
+# Workers forked by the server must open their own connections
+os.register_at_fork(after_in_child=lambda: [
+        async_engine.sync_engine.dispose(close=False)
+        for async_engine in engines])
+# Signs the access tokens and runs the shared sync code
+flask_app = create_app()
+
+JSON_HEADERS = [(b"content-type", b"application/json")]
+
+
+class Request:
+    def __init__(self, scope: dict, body: bytes):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = {key: values[0] for key, values in
+                     parse_qs(scope["query_string"].decode()).items()}
+        self.headers = {key.decode().lower(): value.decode()
+                        for key, value in scope["headers"]}
+        self.cookies = parse_cookie(self.headers.get("cookie", ""))
+        self.body = body
+
+    def json(self):
+        try:
+            return loads(self.body)
+        except ValueError:
+            return None
+
+
+def respond(value, status: int, headers: list = None):
+    return status, dumps(value), JSON_HEADERS + (headers or [])
+
+
+# Decorators definition
+
+def read_only(handler):
+    """Runs `handler` on the replica, unless the client wrote recently and
+    may not find its writes there yet"""
+    handler.read_only = True
+    return handler
+
+
+def _replay(response: tuple[int, str]):
+    status, body = response
+    headers = [] if response in (IN_PROGRESS, MISMATCH) \
+        else [(b"idempotent-replayed", b"true")]
+    return status, body.encode(), JSON_HEADERS + headers
+
+
+def request_user(request: Request) -> str | None:
+    """Identity of the access token of `request`, if valid"""
+    authorization = request.headers.get("authorization", "")
+    if not authorization.startswith("Bearer "):
+        return None
+    try:
+        with flask_app.app_context():
+            token = decode_token(authorization.removeprefix("Bearer "))
+    except (JWTExtendedException, PyJWTError):
+        return None
+    identity = token.get(flask_app.config["JWT_IDENTITY_CLAIM"])
+    return None if identity is None else str(identity)
+
+
+def idempotent(handler):
+    """Same as idempotency.idempotent, sharing its store"""
+
+    @wraps(handler)
+    async def wrapper(request: Request, session):
+        key = request.headers.get("idempotency-key")
+        if not key:
+            return await handler(request, session)
+        cle = idempotency_cle(request.path, key)
+        empreinte = fingerprint(request.body, request_user(request))
+
+        response = lookup(cle, empreinte) or await session.run_sync(
+                lambda sync_session: acquire(cle, empreinte, sync_session))
+        if response is not None:
+            return _replay(response)
+
+        try:
+            status, payload, headers = await handler(request, session)
+        except Exception:
+            await session.run_sync(
+                    lambda sync_session: release(cle, empreinte, None,
+                                                 sync_session))
+            log_release(key, request.path, None)
+            raise
+
+        stored = (status, payload.decode()) if 200 <= status < 300 else None
+        await session.run_sync(
+                lambda sync_session: release(cle, empreinte, stored,
+                                             sync_session))
+        log_release(key, request.path, stored)
+        return status, payload, headers
+    return wrapper
+
+
+# Caches definition
+
+async def load_services() -> dict:
+    services: dict = {}
+    async with Session() as session:
+        for service in (await session.execute(
+                db.select(Service))).scalars():
+            services.update(service.to_dict())
+    return services
+
+
+async def load_hopitaux_snapshot() -> tuple[bytes, str]:
+    async with Session() as session:
+        return build_hopitaux_snapshot(
+                await session.execute(select_hopitaux_services()))
+
+
+async def load_ids() -> dict[str, dict[str, int]]:
+    async with Session() as session:
+        hopitaux = await session.execute(db.select(Hopital.nom, Hopital.id))
+        services = await session.execute(db.select(Service.nom, Service.id))
+        return {"hopitaux": {nom.lower(): id for nom, id in hopitaux},
+                "services": {nom.lower(): id for nom, id in services}}
+
+
+services_catalog = AsyncTTLCache(load_services, SERVICES_CACHE_TTL)
+hopitaux_snapshot = AsyncTTLCache(load_hopitaux_snapshot, HOPITAUX_CACHE_TTL)
+ids_map = AsyncTTLCache(load_ids, HOPITAUX_CACHE_TTL)
+
+
+async def resolve_id(kind: str, nom: str, session) -> int | None:
+    """Same as resources.resolve_id: a name missing from the map is looked up
+    alone and only added to the map when found"""
+    known = (await ids_map.get())[kind]
+    if nom.lower() not in known:
+        for found, id in await session.execute(select_ids(kind, {nom})):
+            known[found.lower()] = id
+    return known.get(nom.lower())
+
+
+# Handlers definition
+
+@read_only
+@async_db_retry
+async def login(request: Request, session):
+    try:
+        user = user_get_schema.load(request.args)
+    except ValidationError as e:
+        logger.error("Error when loading user using GET schema %s: %s",
+                     "(GET /user)", e.messages)
+        return respond({"message": "User not provided correctly"}, 404)
+
+    email = user.get("email")
+    numeroTelephone = user.get("numeroTelephone")
+    if not email and not numeroTelephone:
+        return respond({"message": "No login info was provided"}, 404)
+    password = hash_password(user["password"])
+
+    candidates = (await session.execute(Utilisateur.select_login(
+        email, numeroTelephone, password))).scalars().all()
+    existing_user = Utilisateur.pick_login(candidates, email)
+    if not existing_user:
+        return respond({"message": "Access denied"}, 403)
+
+    with flask_app.app_context():
+        access_token = create_access_token(
+                identity=existing_user.get_identity(), expires_delta=None)
+    result = existing_user.to_dict(access_token)
+    result["services"] = await services_catalog.get()
+    return respond(result, 200)
+
+
+@idempotent
+@async_db_retry
+async def register(request: Request, session):
+    try:
+        user = user_post_schema.load(request.json())
+    except ValidationError as e:
+        logger.error("Error when loading user using POST schema %s: %s",
+                     "(POST /user)", e.messages)
+        return respond({"message": "User not provided correctly"}, 404)
+
+    return respond(*await session.run_sync(
+            lambda sync_session: register_user(user, sync_session)))
+
+
+@read_only
+@async_db_retry
+async def hopitaux(request: Request, session):
+    body, etag = await hopitaux_snapshot.get()
+    quoted = f'"{etag}"'
+    headers = JSON_HEADERS + [(b"etag", quoted.encode())]
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or quoted in \
+            [tag.strip() for tag in if_none_match.split(",")]:
+        return 304, b"", headers
+    return 200, body, headers
+
+
+@idempotent
+@async_db_retry
+async def add_hopital(request: Request, session):
+    try:
+        hopital = hopital_post_schema.load(request.json())
+    except ValidationError as e:
+        logger.error("Error when loading hopital using POST schema %s: %s",
+                     "(POST /hopital)", e.messages)
+        return respond({"message": "Hopital not provided correctly"}, 404)
+
+    try:
+        errors = await session.run_sync(
+                lambda sync_session: import_hopitaux([hopital], sync_session))
+    except Exception as e:
+        await session.rollback()
+        if is_transient(e):
+            raise
+        errors = [str(e)]
+    if errors[0]:
+        logger.error("Could not add hopital '%s': %s", hopital["nom"],
+                     errors[0])
+        return respond({"message": "Invalid request"}, 404)
+
+    services_catalog.invalidate()
+    hopitaux_snapshot.invalidate()
+    ids_map.invalidate()
+    return respond({"message": "Hopital inserted successfully"}, 201)
+
+
+@read_only
+@async_db_retry
+async def rdvs(request: Request, session):
+    try:
+        params = rdv_get_schema.load(request.args)
+        after = decode_cursor(params["cursor"]) \
+            if "cursor" in params else None
+    except (ValidationError, ValueError) as e:
+        logger.error("Error when loading rdv GET schema %s: %s",
+                     "(GET /rdv)", e)
+        return respond({"message": "Invalid request"}, 404)
+
+    limit = params["limit"]
+    rows = (await session.execute(RDV.select_for_user(
+        params["id_user"], start=params.get("start"),
+        end=params.get("end"), after=after, limit=limit))).all()
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_cursor(rows[-1].dateTime, rows[-1].id)
+    return respond({"output": [RDV.row_to_dict(row) for row in rows],
+                    "next_cursor": next_cursor}, 200)
+
+
+@idempotent
+@async_db_retry
+async def book(request: Request, session):
+    try:
+        rdv = rdv_post_schema.load(request.json())
+    except ValidationError as e:
+        logger.error("Error when loading rdv POST schema %s: %s",
+                     "(POST /rdv)", e.messages)
+        return respond({"message": "Invalid request"}, 404)
+
+    hopital_id = await resolve_id("hopitaux", rdv["hopital"], session)
+    service_id = await resolve_id("services", rdv["service"], session) \
+        if hopital_id is not None else None
+    return respond(*await session.run_sync(
+            lambda sync_session: book_rdv(rdv, hopital_id, service_id,
+                                          sync_session)))
+
+
+ROUTES = {
+        ("GET", "/user"): login,
+        ("POST", "/user"): register,
+        ("GET", "/hopital"): hopitaux,
+        ("POST", "/hopital"): add_hopital,
+        ("GET", "/rdv"): rdvs,
+        ("POST", "/rdv"): book,
+        }
+# Methods of every known path, for the 405 answers
+ALLOWED_METHODS = {path: [method for method, route in ROUTES if route == path]
+                   for _, path in ROUTES}
+
+
+# ASGI application
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return body
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            for async_engine in engines:
+                await async_engine.dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    body = await _read_body(receive)
+    request = Request(scope, body)
+    handler = ROUTES.get((request.method, request.path))
+    if handler is None and request.path in ALLOWED_METHODS:
+        allow = ", ".join(ALLOWED_METHODS[request.path])
+        status, payload, headers = respond(
+                {"message": "Method not allowed"}, 405,
+                [(b"allow", allow.encode())])
+    elif handler is None:
+        status, payload, headers = respond({"message": "Not found"}, 404)
+    else:
+        session_factory = ReplicaSession if ReplicaSession is not None \
+            and getattr(handler, "read_only", False) \
+            and not wrote_recently(request.cookies) else Session
+        async with session_factory() as session:
+            try:
+                status, payload, headers = await handler(request, session)
+            except Exception:
+                logger.exception("Unhandled error on %s %s",
+                                 request.method, request.path)
+                await session.rollback()
+                status, payload, headers = respond(
+                        {"message": "Internal Server Error"}, 500)
+        # Same read-your-writes cookie as remember_writes
+        if request.method == "POST" and status < 300:
+            headers = headers + [(b"set-cookie", dump_cookie(
+                    WRITE_COOKIE, str(time.time()),
+                    max_age=WRITE_COOKIE_MAX_AGE, httponly=True).encode())]
+
+    await send({"type": "http.response.start", "status": status,
+                "headers": headers})
+    await send({"type": "http.response.body", "body": payload})
@@ -0,0 +1,76 @@
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from threading import Lock
+from typing import Callable, Iterable
+import time as clock
+
+
+def slot_start(dateTime: datetime, slot: timedelta) -> datetime:
+    """Start of the `slot` long slot containing `dateTime`"""
+    midnight = datetime.combine(dateTime.date(), time())
+    return midnight + (dateTime - midnight) // slot * slot
+
+
+class SlotIndex:
+    """In-memory index of the booked slots of every (hopital_id, service_id).
+
+    The bookings of a key are loaded from `loader(key, since)` on first use
+    and reloaded after `ttl` seconds (to see bookings made by other
+    processes); in between, `add` keeps the index up to date. Only bookings
+    from the current day onwards are indexed. Keys load independently: a
+    slow load only holds back the requests for its own key."""
+
+    def __init__(self, loader: Callable[[tuple, datetime], Iterable[datetime]],
+                 slot: timedelta, ttl: float):
+        self._loader = loader
+        self.slot = slot
+        self.ttl = ttl
+        self._entries: dict[tuple, tuple[Counter, datetime, float]] = {}
+        self._loading: dict[tuple, Lock] = {}
+        self._lock = Lock()
+
+    def slot_start(self, dateTime: datetime) -> datetime:
+        return slot_start(dateTime, self.slot)
+
+    def _counts(self, key: tuple) -> tuple[Counter, datetime]:
+        entry = self._entries.get(key)
+        if entry is None or clock.monotonic() >= entry[2]:
+            with self._lock:
+                loading = self._loading.setdefault(key, Lock())
+            # Only one load per key, run without holding the index
+            with loading:
+                entry = self._entries.get(key)
+                if entry is None or clock.monotonic() >= entry[2]:
+                    since = datetime.combine(date.today(), time())
+                    counts = Counter(self.slot_start(dateTime)
+                                     for dateTime in self._loader(key, since))
+                    entry = (counts, since, clock.monotonic() + self.ttl)
+                    with self._lock:
+                        self._entries[key] = entry
+        return entry[0], entry[1]
+
+    def add(self, key: tuple, dateTime: datetime):
+        """Records a committed booking, if the key is indexed"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and dateTime >= entry[1]:
+                entry[0][self.slot_start(dateTime)] += 1
+
+    def free_slots(self, key: tuple, day: date, opening: time, closing: time,
+                   capacity: int) -> list[datetime]:
+        """Starts of the slots of `day` between `opening` and `closing` that
+        have fewer than `capacity` bookings and have not started yet"""
+        counts, since = self._counts(key)
+        earliest = max(since, datetime.now())
+        slot = datetime.combine(day, opening)
+        end = datetime.combine(day, closing)
+        free: list[datetime] = []
+        while slot + self.slot <= end:
+            if slot >= earliest and counts[slot] < capacity:
+                free.append(slot)
+            slot += self.slot
+        return free
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,109 @@
+from collections import OrderedDict
+import asyncio
+from itertools import count
+from threading import Lock
+from typing import Callable
+import time
+
+_MISSING = object()
+
+
+class TTLCache:
+    """In-process cache of the value returned by `loader`.
+
+    The value is reloaded once `ttl` seconds went by or after `invalidate`
+    was called. Every invalidation bumps `version`, so a load that was
+    running while the cache got invalidated is returned to its caller but
+    never stored."""
+
+    def __init__(self, loader: Callable, ttl: float):
+        self._loader = loader
+        self.ttl = ttl
+        self._versions = count(1)
+        self.version = next(self._versions)
+        # (value, expiry), replaced as a whole so that readers never see a
+        # value with another value's expiry
+        self._entry = None
+        self._lock = Lock()  # Guards version and _entry
+        self._loading = Lock()  # Only one thread reloads the value
+
+    def _cached(self):
+        """The current value, or _MISSING when absent or expired"""
+        entry = self._entry
+        if entry is None or time.monotonic() >= entry[1]:
+            return _MISSING
+        return entry[0]
+
+    def _store(self, version: int, value):
+        with self._lock:
+            if version == self.version:
+                self._entry = (value, time.monotonic() + self.ttl)
+
+    def get(self):
+        value = self._cached()
+        if value is not _MISSING:
+            return value
+        with self._loading:
+            value = self._cached()
+            if value is not _MISSING:
+                return value
+            with self._lock:
+                version = self.version
+            value = self._loader()
+            self._store(version, value)
+            return value
+
+    def invalidate(self):
+        with self._lock:
+            self.version = next(self._versions)
+            self._entry = None
+
+
+class AsyncTTLCache(TTLCache):
+    """TTLCache whose loader is a coroutine function, for the async mode"""
+
+    def __init__(self, loader: Callable, ttl: float):
+        super().__init__(loader, ttl)
+        self._loading = asyncio.Lock()
+
+    async def get(self):
+        value = self._cached()
+        if value is not _MISSING:
+            return value
+        async with self._loading:
+            value = self._cached()
+            if value is not _MISSING:
+                return value
+            with self._lock:
+                version = self.version
+            value = await self._loader()
+            self._store(version, value)
+            return value
+
+
+class LRUCache:
+    """Thread-safe mapping keeping only the `maxsize` most recently used
+    entries"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,5 +1,34 @@
 from hashlib import sha256
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from flask import current_app, request
 
 
 def hash_password(pssw: str) -> str:
     return sha256(pssw.encode()).hexdigest()
+
+
+def encode_cursor(dateTime: datetime, id: int) -> str:
+    """Opaque pagination cursor pointing after the row (dateTime, id)"""
+    raw = f"{dateTime.isoformat()}|{id}"
+    return urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Inverse of `encode_cursor`, raises ValueError on a malformed cursor"""
+    try:
+        raw = urlsafe_b64decode(cursor.encode()).decode()
+        dateTime, id = raw.split("|")
+        return datetime.fromisoformat(dateTime), int(id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor '{cursor}'") from e
+
+
+def resource_method() -> str:
+    """Resource method handling the current request, e.g. RDVs.get"""
+    view = current_app.view_functions.get(request.endpoint)
+    view_class = getattr(view, "view_class", None)
+    if view_class is None:
+        return f"{request.method} {request.path}"
+    return f"{view_class.__name__}.{request.method.lower()}"
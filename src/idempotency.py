@@ -0,0 +1,183 @@
+from datetime import datetime
+from functools import wraps
+from hashlib import sha256
+import json
+from threading import Lock
+import time
+
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from flask_restful import request
+from jwt import PyJWTError
+from sqlalchemy.exc import IntegrityError
+
+from .cache import LRUCache
+from .models.models import db, Idempotence
+from .models.init import logger, IDEMPOTENCY_CACHE_SIZE, \
+        IDEMPOTENCY_LOCK_TIMEOUT, IDEMPOTENCY_TTL
+
+# Recently stored responses, answered without querying the database, as
+# (empreinte, (status, body), expiry)
+responses = LRUCache(IDEMPOTENCY_CACHE_SIZE)
+
+# Answered while the request owning the key has not finished
+IN_PROGRESS = (409, json.dumps(
+        {"message": "A request with this Idempotency-Key is in progress"}))
+# Answered when the key comes back with another body or user
+MISMATCH = (422, json.dumps(
+        {"message": "This Idempotency-Key was used for another request"}))
+
+# Seconds between two deletions of the expired rows by a process
+PURGE_INTERVAL = 60
+_next_purge = 0.0
+_purge_lock = Lock()
+
+
+def idempotency_cle(path: str, key: str) -> str:
+    return sha256(f"{path}:{key}".encode()).hexdigest()
+
+
+def fingerprint(body: bytes, user: str | None) -> str:
+    """Empreinte of a request, telling a retry from another request sent
+    with the same key"""
+    return sha256(f"{user or ''}:".encode() + body).hexdigest()
+
+
+def request_user() -> str | None:
+    """Identity of the access token of the current request, if valid"""
+    try:
+        verify_jwt_in_request(optional=True)
+    except (JWTExtendedException, PyJWTError):
+        return None
+    identity = get_jwt_identity()
+    return None if identity is None else str(identity)
+
+
+def _replay(response: tuple[int, str]):
+    status, body = response
+    if response in (IN_PROGRESS, MISMATCH):
+        return json.loads(body), status
+    return json.loads(body), status, {"Idempotent-Replayed": "true"}
+
+
+def lookup(cle: str, empreinte: str) -> tuple[int, str] | None:
+    """Response to send back from the recently stored ones, if any"""
+    entry = responses.get(cle)
+    if entry is None or entry[2] <= datetime.now():
+        return None
+    return entry[1] if entry[0] == empreinte else MISMATCH
+
+
+def _purge(session):
+    """Deletes the rows older than IDEMPOTENCY_TTL, at most once every
+    PURGE_INTERVAL seconds"""
+    global _next_purge
+    with _purge_lock:
+        if time.monotonic() < _next_purge:
+            return
+        _next_purge = time.monotonic() + PURGE_INTERVAL
+    deleted = session.execute(db.delete(Idempotence).where(
+        Idempotence.cree < datetime.now() - IDEMPOTENCY_TTL)).rowcount
+    session.commit()
+    if deleted:
+        logger.info("Deleted %d expired Idempotency-Key rows", deleted)
+
+
+def acquire(cle: str, empreinte: str,
+            session=db.session) -> tuple[int, str] | None:
+    """Inserts the placeholder of a new request. Returns None if the caller
+    now owns the key, otherwise the (status, body) to send back: the stored
+    response, IN_PROGRESS or MISMATCH. `session` lets the async mode run it
+    through run_sync"""
+    _purge(session)
+    try:
+        session.add(Idempotence(cle=cle, empreinte=empreinte,
+                                cree=datetime.now()))
+        session.commit()
+        return None
+    except IntegrityError:
+        session.rollback()
+
+    stored = session.get(Idempotence, cle)
+    # Rows stored before the empreinte column have none to compare
+    if stored is not None and stored.empreinte not in (None, empreinte):
+        return MISMATCH
+    if stored is not None and stored.statut is not None:
+        response = (stored.statut, stored.reponse)
+        responses.put(cle, (empreinte, response,
+                            stored.cree + IDEMPOTENCY_TTL))
+        return response
+
+    # Taking over a placeholder left behind by a request that died
+    now = datetime.now()
+    taken = session.execute(
+            db.update(Idempotence)
+            .where(Idempotence.cle == cle,
+                   Idempotence.statut.is_(None),
+                   Idempotence.cree < now - IDEMPOTENCY_LOCK_TIMEOUT)
+            .values(cree=now)).rowcount == 1
+    session.commit()
+    if taken:
+        return None
+    return IN_PROGRESS
+
+
+def release(cle: str, empreinte: str, response: tuple[int, str] | None,
+            session=db.session):
+    """Stores the response of the request owning `cle`, or frees the key so
+    that the request can be sent again when there is nothing to store"""
+    session.rollback()
+    if response is None:
+        session.execute(db.delete(Idempotence).where(
+            Idempotence.cle == cle))
+    else:
+        session.execute(db.update(Idempotence)
+                        .where(Idempotence.cle == cle)
+                        .values(statut=response[0], reponse=response[1]))
+        responses.put(cle, (empreinte, response,
+                            datetime.now() + IDEMPOTENCY_TTL))
+    session.commit()
+
+
+def log_release(key: str, path: str, stored: tuple[int, str] | None):
+    if stored is not None:
+        logger.info("Stored response of Idempotency-Key %s (%s)", key, path)
+    else:
+        logger.info("Freed Idempotency-Key %s (%s): nothing to store", key,
+                    path)
+
+
+def idempotent(method):
+    """Answers a POST sent again with the same Idempotency-Key header with
+    the response of the first one, without running `method` twice, for
+    IDEMPOTENCY_TTL. Only successful responses are stored; otherwise the key
+    is freed so that the request can be fixed or sent again. The key sent
+    with another body, or by another user, is answered with 422"""
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key:
+            return method(*args, **kwargs)
+        cle = idempotency_cle(request.path, key)
+        empreinte = fingerprint(request.get_data(), request_user())
+
+        response = lookup(cle, empreinte) or acquire(cle, empreinte)
+        if response is not None:
+            return _replay(response)
+
+        try:
+            result = method(*args, **kwargs)
+        except Exception:
+            release(cle, empreinte, None)
+            log_release(key, request.path, None)
+            raise
+
+        stored = None
+        if isinstance(result, tuple) and isinstance(result[0], dict) \
+                and 200 <= result[1] < 300:
+            stored = (result[1], json.dumps(result[0]))
+        release(cle, empreinte, stored)
+        log_release(key, request.path, stored)
+        return result
+    return wrapper
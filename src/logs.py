@@ -0,0 +1,60 @@
+from logging.handlers import QueueHandler, QueueListener, \
+        RotatingFileHandler
+from queue import SimpleQueue
+import atexit
+import os
+import logging
+import random
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through only a `rate` fraction of the records below WARNING"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= logging.WARNING or self.rate >= 1 \
+            or random.random() < self.rate
+
+
+class LazyQueueHandler(QueueHandler):
+    """Enqueues records untouched: the message is only formatted by the
+    listener thread, not by the thread that logged it"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(filename: str, level: str, sample_rate: float,
+                  max_bytes: int, backups: int) -> QueueListener:
+    """Routes the root logger through a queue to a rotating file written by
+    a background thread, stopped when the interpreter exits"""
+    file_handler = RotatingFileHandler(filename, encoding="utf-8",
+                                       maxBytes=max_bytes,
+                                       backupCount=backups)
+    file_handler.setFormatter(logging.Formatter(
+        datefmt="%Y/%m/%d %H-%M-%S",
+        fmt="%(levelname)s:%(asctime)s:%(message)s"))
+
+    queue = SimpleQueue()
+    queue_handler = LazyQueueHandler(queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+
+    listener = QueueListener(queue, file_handler,
+                             respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    os.register_at_fork(after_in_child=lambda: _restart(listener))
+    return listener
+
+
+def _restart(listener: QueueListener):
+    # Only the forking thread survives a fork, the child needs its own
+    # writer thread
+    listener._thread = None
+    listener.start()
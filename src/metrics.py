@@ -0,0 +1,178 @@
+from bisect import bisect_left
+from threading import Lock
+from typing import Callable
+import time
+
+from flask import Flask, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Histogram:
+    """Prometheus histogram, with one series per set of labels"""
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...]):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series: dict[Labels, list] = {}
+        self._lock = Lock()
+        registry.append(self)
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = \
+                    [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: ([*counts], total)
+                      for key, (counts, total) in self._series.items()}
+        for key, (counts, total) in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket"
+                             f"{_format_labels(key, (('le', str(bound)),))}"
+                             f" {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket"
+                         f"{_format_labels(key, (('le', '+Inf'),))}"
+                         f" {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Metric whose values are read from `collect` when rendered; `collect`
+    returns the value of every set of labels"""
+
+    def __init__(self, name: str, help: str,
+                 collect: Callable[[], dict[Labels, float]],
+                 type: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.type = type
+        registry.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} {self.type}"]
+        for key, value in self.collect().items():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+registry: list = []
+
+
+def render_metrics() -> str:
+    """Every registered metric in the Prometheus text format"""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+pool_checkout_seconds = Histogram(
+        "medico_db_pool_checkout_seconds",
+        "Time spent waiting for a connection from the pool",
+        (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30))
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long every checkout waited"""
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            pool_checkout_seconds.observe(time.perf_counter() - start)
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+request_duration_seconds = Histogram(
+        "medico_request_duration_seconds",
+        "Time spent handling a request, by endpoint",
+        LATENCY_BUCKETS)
+request_db_statements = Histogram(
+        "medico_request_db_statements",
+        "SQL statements executed by a request",
+        (0, 1, 2, 3, 5, 10, 20, 50, 100, 500))
+request_db_seconds = Histogram(
+        "medico_request_db_seconds",
+        "Time a request spent executing SQL statements",
+        LATENCY_BUCKETS)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info.setdefault("statement_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.perf_counter() - conn.info["statement_start"].pop()
+    if has_request_context() and "request_start" in g:
+        g.db_statements += 1
+        g.db_seconds += elapsed
+
+
+def _handle_error(context):
+    # The statement failed, after_cursor_execute will not pop its start
+    starts = context.connection.info.get("statement_start") \
+        if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    g.db_statements = 0
+    g.db_seconds = 0.0
+
+
+def _record_request(response):
+    if "request_start" in g:
+        # Unknown URLs share a label, so that scanners cannot blow up the
+        # number of series
+        endpoint = request.endpoint or "unmatched"
+        request_duration_seconds.observe(
+                time.perf_counter() - g.request_start, endpoint=endpoint,
+                method=request.method, status=str(response.status_code))
+        request_db_statements.observe(g.db_statements, endpoint=endpoint)
+        request_db_seconds.observe(g.db_seconds, endpoint=endpoint)
+    return response
+
+
+def instrument(app: Flask):
+    """Records the latency, SQL statement count and SQL time of every
+    request of `app`, on any engine"""
+    if not event.contains(Engine, "handle_error", _handle_error):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+    app.before_request(_start_request)
+    app.after_request(_record_request)
@@ -1,8 +1,6 @@
 import os
-from flask_restful import Api
 from dotenv import find_dotenv, load_dotenv
-from flask import Flask
-from datetime import timedelta
+from datetime import timedelta, time
 import logging
 
 find_dotenv("../../.env")
@@ -15,22 +13,75 @@ USER = os.getenv("USERNAME")
 PASSWORD = os.getenv("PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 SECRET_KEY = os.getenv("SECRET_KEY")
+# Overrides the MySQL database, e.g. with a SQLite file for benchmarks
+DATABASE_URL = os.getenv("DATABASE_URL",
+                         f"mysql+mysqldb://{USER}:{PASSWORD}@{HOST}/{DB_NAME}")
+# Database of the async serving mode, through an async driver
+ASYNC_DATABASE_URL = os.getenv(
+        "ASYNC_DATABASE_URL",
+        DATABASE_URL.replace("mysql+mysqldb://", "mysql+aiomysql://")
+        .replace("sqlite://", "sqlite+aiosqlite://"))
+# Read replica used by the read-only requests, if any
+REPLICA_DATABASE_URL = os.getenv("REPLICA_DATABASE_URL")
+ASYNC_REPLICA_DATABASE_URL = os.getenv(
+        "ASYNC_REPLICA_DATABASE_URL",
+        REPLICA_DATABASE_URL and REPLICA_DATABASE_URL
+        .replace("mysql+mysqldb://", "mysql+aiomysql://")
+        .replace("sqlite://", "sqlite+aiosqlite://"))
+# Seconds during which a client reads from the primary after writing
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", 10))
+# Connection pool of the database engine
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+# Below MySQL's wait_timeout so that idle connections are never "gone away"
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
 EXPIRES = timedelta(minutes=8)
+RDV_PAGE_SIZE = int(os.getenv("RDV_PAGE_SIZE", 50))
+RDV_MAX_PAGE_SIZE = 200
+SERVICES_CACHE_TTL = float(os.getenv("SERVICES_CACHE_TTL", 300))
+HOPITAUX_CACHE_TTL = float(os.getenv("HOPITAUX_CACHE_TTL", 300))
+HOPITAL_BATCH_SIZE = int(os.getenv("HOPITAL_BATCH_SIZE", 500))
+RDV_BATCH_SIZE = int(os.getenv("RDV_BATCH_SIZE", 1000))
+# Retries of transient database errors
+DB_RETRY_ATTEMPTS = int(os.getenv("DB_RETRY_ATTEMPTS", 3))
+DB_RETRY_BUDGET = float(os.getenv("DB_RETRY_BUDGET", 2))
+# Replay of POST requests sent with an Idempotency-Key header
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10000))
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(
+        seconds=int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", 60)))
+# How long a stored response is replayed before its row is deleted
+IDEMPOTENCY_TTL = timedelta(
+        seconds=int(os.getenv("IDEMPOTENCY_TTL", 24 * 3600)))
+# Appointment slots of every (hopital, service). The creneau rows are built
+# for one slot length: after changing SLOT_MINUTES, run
+# `flask --app api rebuild-creneaux` before serving bookings again
+SLOT_DURATION = timedelta(minutes=int(os.getenv("SLOT_MINUTES", 30)))
+# RDVs per slot; past this, POST /rdv answers 409
+SLOT_CAPACITY = int(os.getenv("SLOT_CAPACITY", 1))
+OPENING_TIME = time.fromisoformat(os.getenv("OPENING_TIME", "08:00"))
+CLOSING_TIME = time.fromisoformat(os.getenv("CLOSING_TIME", "17:00"))
+AVAILABILITY_TTL = float(os.getenv("AVAILABILITY_TTL", 60))
+# SQL debug mode, logging N+1 suspects and slow statements
+SQL_DEBUG = os.getenv("SQL_DEBUG", "false").lower() == "true"
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", 0.2))
+# Profiling of the requests carrying an X-Profile header signed with
+# PROFILE_SECRET, or of a random PROFILE_SAMPLE_RATE fraction of them, at
+# most once every PROFILE_MIN_INTERVAL seconds
+PROFILE_SECRET = os.getenv("PROFILE_SECRET")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_MIN_INTERVAL = float(os.getenv("PROFILE_MIN_INTERVAL", 60))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
 
 # Logging setup
 
-logger = logging.getLogger(__name__)
-logging.basicConfig(filename="log.log", encoding="utf-8",
-                    datefmt="%Y/%m/%d %H-%M-%S",
-                    format="%(levelname)s:%(asctime)s:%(message)s",
-                    level=logging.DEBUG)
-
-# App setup
+LOG_FILE = os.getenv("LOG_FILE", "log.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fraction of the DEBUG and INFO records that are kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1))
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", 5))
 
-app = Flask(__name__)
-api = Api(app)
-
-app.config["SQLALCHEMY_DATABASE_URI"] = \
-        f"mysql+mysqldb://{USER}:{PASSWORD}@{HOST}/{DB_NAME}"
-app.config["JWT_SECRET_KEY"] = SECRET_KEY
-app.config["JWT_ACCESS_TOKEN_EXPIRES"] = EXPIRES
+logger = logging.getLogger(__name__)
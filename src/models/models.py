@@ -1,22 +1,15 @@
-from .init import app, logger
+from .routing import RoutingSession
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from datetime import datetime
-from flask_migrate import Migrate
 
 
 class Base(DeclarativeBase):
     pass
 
 
-try:
-    db = SQLAlchemy(app, model_class=Base)
-    logger.info("Connected to database")
-    migrate = Migrate(app, db)
-    logger.info("Applied migrations...")
-except Exception as e:
-    logger.error(f"Error encountered when connecting to database: {e}")
-    raise e
+# Bound to the app by create_app
+db = SQLAlchemy(model_class=Base, session_options={"class_": RoutingSession})
 
 
 class Utilisateur(db.Model):
@@ -36,6 +29,28 @@ class Utilisateur(db.Model):
     def get_identity(self):
         return self.nom
 
+    @staticmethod
+    def select_login(email: str, numeroTelephone: str, password: str):
+        """Selects the users matching the given identifiers (only the ones
+        provided) and hashed password, in a single statement"""
+        identifiers = []
+        if email:
+            identifiers.append(Utilisateur.email == email)
+        if numeroTelephone:
+            identifiers.append(Utilisateur.numeroTelephone == numeroTelephone)
+        return db.select(Utilisateur).where(db.or_(*identifiers),
+                                            Utilisateur.password == password)
+
+    @staticmethod
+    def pick_login(candidates: list, email: str):
+        """The user granted access among the `select_login` results, the
+        email taking precedence when both identifiers match"""
+        existing_user = None
+        for candidate in candidates:
+            if existing_user is None or (email and candidate.email == email):
+                existing_user = candidate
+        return existing_user
+
     def to_dict(self, access_token: str = ""):
         return {
                 "id": self.id,
@@ -53,9 +68,18 @@ class Utilisateur(db.Model):
 
 service_hopital = db.Table('service_hopital',
                            db.Column('service_id',
-                                     db.Integer, db.ForeignKey('service.id')),
+                                     db.Integer, db.ForeignKey('service.id'),
+                                     nullable=False),
                            db.Column('hopital_id',
-                                     db.Integer, db.ForeignKey('hopital.id'))
+                                     db.Integer, db.ForeignKey('hopital.id'),
+                                     nullable=False),
+                           # Hopital first: GET /hopital walks the links
+                           # of every hopital
+                           db.PrimaryKeyConstraint('hopital_id',
+                                                   'service_id',
+                                                   name='pk_service_hopital'),
+                           db.Index('ix_service_hopital_service_id',
+                                    'service_id')
                            )
 
 
@@ -93,17 +117,35 @@ utilisateur_rdv = db.Table('utilisateur_service_hopital',
                                      db.Integer,
                                      db.ForeignKey(
                                          'utilisateur.id'
-                                         )),
+                                         ),
+                                     nullable=False),
                            db.Column('rdv_id',
                                      db.Integer,
                                      db.ForeignKey(
                                          'rdv.id'
-                                         )),
+                                         ),
+                                     nullable=False),
+                           db.PrimaryKeyConstraint(
+                               'utilisateur_id', 'rdv_id',
+                               name='pk_utilisateur_service_hopital'),
+                           db.Index('ix_utilisateur_service_hopital_rdv_id',
+                                    'rdv_id')
                            )
 
 
 class RDV(db.Model):
     __tablename__ = "rdv"
+    __table_args__ = (
+            # Serves the keyset pagination of GET /rdv, and the foreign key
+            # on utilisateur_id
+            db.Index("ix_rdv_utilisateur_id_dateTime_id",
+                     "utilisateur_id", "dateTime", "id"),
+            # Serves the booked slots of GET /disponibilite, and the foreign
+            # key on hopital_id
+            db.Index("ix_rdv_hopital_id_service_id_dateTime",
+                     "hopital_id", "service_id", "dateTime"),
+            db.Index("ix_rdv_service_id", "service_id"),
+            )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     nom = db.Column(db.String(254), nullable=False)
     sexe = db.Column(db.String(1), nullable=False)
@@ -116,7 +158,6 @@ class RDV(db.Model):
     utilisateur_id = db.Column(db.Integer, db.ForeignKey('utilisateur.id'))
 
     def to_dict(self):
-        format = "%Y-%m-%d %H:%M:%S"
         return {
                 "id": self.id,
                 "nom": self.nom,
@@ -124,8 +165,108 @@ class RDV(db.Model):
                 "contact": self.contact,
                 "province": self.province,
                 "commune": self.commune,
-                "dateTime": datetime.strftime(self.dateTime, format),
+                "dateTime": self.dateTime,
                 "hopital": self.hopital.nom,
-                "reference_id": self.reference.id,
+                "reference_id": self.utilisateur_id,
                 "service": self.service.nom
                 }
+
+    @staticmethod
+    def select_for_user(utilisateur_id: int, start: datetime = None,
+                        end: datetime = None, after: tuple = None,
+                        limit: int = None):
+        """Selects the RDVs of a user together with the names of their
+        hopital and service, so that a page of the history is fetched in a
+        single statement instead of lazy loading the relationships row by row.
+
+        Rows are ordered by (dateTime, id); `after` is the (dateTime, id) of
+        the last row of the previous page (keyset pagination)"""
+        stmt = db.select(RDV.id, RDV.nom, RDV.sexe, RDV.contact,
+                         RDV.province, RDV.commune, RDV.dateTime,
+                         RDV.utilisateur_id,
+                         Hopital.nom.label("hopital"),
+                         Service.nom.label("service")) \
+            .outerjoin(Hopital, RDV.hopital_id == Hopital.id) \
+            .outerjoin(Service, RDV.service_id == Service.id) \
+            .where(RDV.utilisateur_id == utilisateur_id)
+        if start is not None:
+            stmt = stmt.where(RDV.dateTime >= start)
+        if end is not None:
+            stmt = stmt.where(RDV.dateTime < end)
+        if after is not None:
+            # Spelled out rather than as a row value comparison, which MySQL
+            # does not use the (utilisateur_id, dateTime, id) index for
+            dateTime, id = after
+            stmt = stmt.where(db.or_(RDV.dateTime > dateTime,
+                                     db.and_(RDV.dateTime == dateTime,
+                                             RDV.id > id)))
+        stmt = stmt.order_by(RDV.dateTime, RDV.id)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        return stmt
+
+    @staticmethod
+    def row_to_dict(row) -> dict:
+        """Same output as `to_dict` but built from a row of `select_for_user`"""
+        return {
+                "id": row.id,
+                "nom": row.nom,
+                "sexe": row.sexe,
+                "contact": row.contact,
+                "province": row.province,
+                "commune": row.commune,
+                "dateTime": row.dateTime,
+                "hopital": row.hopital,
+                "reference_id": row.utilisateur_id,
+                "service": row.service
+                }
+
+
+class Creneau(db.Model):
+    """Number of RDVs booked in a slot of a service at a hospital, used to
+    enforce the slot capacity atomically"""
+    __tablename__ = "creneau"
+    __table_args__ = (
+            db.UniqueConstraint("hopital_id", "service_id", "debut"),
+            )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    hopital_id = db.Column(db.Integer, db.ForeignKey('hopital.id'),
+                           nullable=False)
+    service_id = db.Column(db.Integer, db.ForeignKey('service.id'),
+                           nullable=False)
+    debut = db.Column(db.DateTime, nullable=False)
+    reservations = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def select_existing(slots: set[tuple[int, int, datetime]]):
+        """Selects which of the (hopital_id, service_id, debut) slots have a
+        row"""
+        return db.select(Creneau.hopital_id, Creneau.service_id,
+                         Creneau.debut).where(
+                db.tuple_(Creneau.hopital_id, Creneau.service_id,
+                          Creneau.debut).in_(slots))
+
+    @staticmethod
+    def reserve(slot: tuple[int, int, datetime], places: int, capacity: int):
+        """Takes `places` places of the slot if it stays within `capacity`;
+        the statement updates one row on success and none otherwise"""
+        hopital_id, service_id, debut = slot
+        return db.update(Creneau) \
+            .where(Creneau.hopital_id == hopital_id,
+                   Creneau.service_id == service_id,
+                   Creneau.debut == debut,
+                   Creneau.reservations + places <= capacity) \
+            .values(reservations=Creneau.reservations + places)
+
+
+class Idempotence(db.Model):
+    """Response of a POST request sent with an Idempotency-Key header, replayed
+    when the same key is sent again with the same request (`empreinte`, hash
+    of its body and user). `statut` is null while the first request is still
+    running"""
+    __tablename__ = "idempotence"
+    cle = db.Column(db.String(64), primary_key=True)
+    empreinte = db.Column(db.String(64), nullable=True)
+    statut = db.Column(db.Integer, nullable=True)
+    reponse = db.Column(db.Text, nullable=True)
+    cree = db.Column(db.DateTime, nullable=False, index=True)
@@ -0,0 +1,79 @@
+from functools import wraps
+import time
+
+from flask import current_app, request
+from flask_sqlalchemy.session import Session
+
+from .init import READ_YOUR_WRITES_WINDOW
+
+REPLICA = "replica"
+# Set on successful writes, reads of the same client go to the primary
+# until it expires
+WRITE_COOKIE = "medico_last_write"
+WRITE_COOKIE_MAX_AGE = int(READ_YOUR_WRITES_WINDOW) + 1
+
+
+class RoutingSession(Session):
+    """Session sending the statements of read-only requests to the replica
+    bind, when one is configured"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get(REPLICA) and not self._flushing \
+                and REPLICA in self._db.engines:
+            return self._db.engines[REPLICA]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+def wrote_recently(cookies: dict = None) -> bool:
+    """Whether the client of the current request, or the one sending
+    `cookies`, wrote within the last READ_YOUR_WRITES_WINDOW seconds"""
+    if cookies is None:
+        cookies = request.cookies
+    try:
+        last_write = float(cookies.get(WRITE_COOKIE, 0))
+    except ValueError:
+        return False
+    return time.time() - last_write < READ_YOUR_WRITES_WINDOW
+
+
+def read_only(method):
+    """Runs `method` against the replica, unless the client wrote recently
+    and may not find its writes there yet"""
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        session = current_app.extensions["sqlalchemy"].session
+        session.info[REPLICA] = not wrote_recently()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            session.info.pop(REPLICA, None)
+    return wrapper
+
+
+def primary(loader):
+    """Runs `loader` against the primary even within a read-only request.
+    Meant for the loaders of the shared in-process caches, which would
+    otherwise keep serving a lagging replica's data to the clients that
+    just wrote"""
+
+    @wraps(loader)
+    def wrapper(*args, **kwargs):
+        session = current_app.extensions["sqlalchemy"].session
+        previous = session.info.pop(REPLICA, None)
+        try:
+            return loader(*args, **kwargs)
+        finally:
+            if previous is not None:
+                session.info[REPLICA] = previous
+    return wrapper
+
+
+def remember_writes(response):
+    if request.method in ("POST", "PUT", "PATCH", "DELETE") \
+            and response.status_code < 300:
+        response.set_cookie(WRITE_COOKIE, str(time.time()),
+                            max_age=WRITE_COOKIE_MAX_AGE,
+                            httponly=True)
+    return response
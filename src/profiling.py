@@ -0,0 +1,170 @@
+"""On-demand profiling of single requests, safe to leave enabled in
+production: at most one request is profiled every PROFILE_MIN_INTERVAL
+seconds, and only when it carries a valid signed X-Profile header or is
+drawn with probability PROFILE_SAMPLE_RATE.
+
+Every profiled request leaves two files in PROFILE_DIR, named after its
+resource method: <name>.prof, the cProfile stats (e.g. for pstats or
+snakeviz), and <name>.collapsed, its sampled stacks in the collapsed format
+of flamegraph.pl and speedscope. The name is returned in the X-Profile-Id
+response header.
+
+Usage: python -m src.profiling prints a header valid for SIGNATURE_TTL
+seconds, signed with PROFILE_SECRET.
+"""
+from collections import Counter
+import cProfile
+from datetime import datetime
+import hashlib
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+
+from flask import Flask, g, request
+
+from .functions import resource_method
+from .models.init import logger, PROFILE_SECRET, PROFILE_SAMPLE_RATE, \
+        PROFILE_MIN_INTERVAL, PROFILE_DIR
+
+HEADER = "X-Profile"
+SIGNATURE_TTL = 300
+SAMPLE_INTERVAL = 0.001
+
+
+def sign(secret: str, timestamp: int) -> str:
+    """Value of the X-Profile header, as `timestamp`.`signature`"""
+    signature = hmac.new(secret.encode(), str(timestamp).encode(),
+                         hashlib.sha256).hexdigest()
+    return f"{timestamp}.{signature}"
+
+
+def valid_signature(value: str) -> bool:
+    if not PROFILE_SECRET:
+        return False
+    try:
+        timestamp = int(value.split(".", 1)[0])
+    except ValueError:
+        return False
+    return abs(time.time() - timestamp) <= SIGNATURE_TTL and \
+        hmac.compare_digest(value, sign(PROFILE_SECRET, timestamp))
+
+
+class Gate:
+    """Lets one profile through at a time, and no more than one every
+    `interval` seconds"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._last = float("-inf")
+        self._busy = False
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            if self._busy or now - self._last < self.interval:
+                return False
+            self._busy = True
+            self._last = now
+            return True
+
+    def release(self):
+        with self._lock:
+            self._busy = False
+
+
+class RequestProfile:
+    """cProfile of the current thread, plus a sampler thread collecting
+    its stacks"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.stacks: Counter = Counter()
+        self._thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+
+    def start(self):
+        self._sampler.start()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self._stopped.set()
+        self._sampler.join()
+
+    def _sample(self):
+        while not self._stopped.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                filename = os.path.basename(code.co_filename)
+                stack.append(
+                    f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path: str):
+        self.profile.dump_stats(f"{path}.prof")
+        with open(f"{path}.collapsed", "w") as f:
+            for stack, count in self.stacks.items():
+                f.write(f"{stack} {count}\n")
+
+
+gate = Gate(PROFILE_MIN_INTERVAL)
+
+
+def _start_profile():
+    signed = HEADER in request.headers
+    if signed and not valid_signature(request.headers[HEADER]):
+        logger.warning("Invalid %s header from %s", HEADER,
+                       request.remote_addr)
+        return
+    if not signed and random.random() >= PROFILE_SAMPLE_RATE:
+        return
+    if not gate.acquire():
+        return
+    g.profile = RequestProfile()
+    g.profile.start()
+
+
+def _finish_profile(response=None):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return response
+    try:
+        profile.stop()
+        # Down to the millisecond, so that two profiles of the same method
+        # within a second do not overwrite each other
+        name = f"{resource_method().replace(' ', '_').replace('/', '_')}-" \
+               f"{datetime.now():%Y%m%d-%H%M%S-%f}"[:-3]
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile.write(os.path.join(PROFILE_DIR, name))
+        logger.info("Profiled %s %s into %s", request.method, request.path,
+                    name)
+        if response is not None:
+            response.headers["X-Profile-Id"] = name
+    except Exception as e:
+        logger.error("Could not write the profile of %s %s: %s",
+                     request.method, request.path, e)
+    finally:
+        gate.release()
+    return response
+
+
+def enable_profiling(app: Flask):
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    # Requests failing before after_request still stop their profile
+    app.teardown_request(lambda exception: _finish_profile())
+
+
+if __name__ == "__main__":
+    if not PROFILE_SECRET:
+        raise SystemExit("PROFILE_SECRET is not set")
+    print(f"{HEADER}: {sign(PROFILE_SECRET, int(time.time()))}")
@@ -1,22 +1,36 @@
+from collections import Counter
 from flask import jsonify, Response
-from flask_restful import Resource, abort, request, marshal_with, \
-        HTTPException
-from marshmallow import Schema, fields
-
-from .models.models import app, db, Utilisateur, Hopital, \
-        Service, service_hopital, RDV
-from .models.init import logger
-from .functions import hash_password
-
-from tenacity import retry, wait_exponential, \
-        stop_after_attempt, retry_if_not_exception_type
+from datetime import datetime
+from hashlib import sha256
+from functools import wraps
+import json
+from flask_restful import Resource, abort, request, marshal_with
+from marshmallow import Schema, fields, validate, ValidationError
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import QueuePool
+
+from .models.models import db, Utilisateur, Hopital, \
+        Service, service_hopital, RDV, Creneau
+from .models.routing import read_only, primary
+from .models.init import logger, RDV_PAGE_SIZE, RDV_MAX_PAGE_SIZE, \
+        SERVICES_CACHE_TTL, HOPITAUX_CACHE_TTL, HOPITAL_BATCH_SIZE, \
+        RDV_BATCH_SIZE, SLOT_DURATION, SLOT_CAPACITY, OPENING_TIME, \
+        CLOSING_TIME, AVAILABILITY_TTL
+from .functions import hash_password, encode_cursor, decode_cursor
+from .cache import TTLCache
+from .availability import SlotIndex, slot_start
+
+from .retry import db_retry, is_transient, retry_counts
+from .metrics import Gauge, render_metrics
+from .serialization import dumps, json_response
+from .idempotency import idempotent, responses
 
 from flask_jwt_extended import create_access_token
 from flask_jwt_extended import get_jwt_identity
 from flask_jwt_extended import jwt_required
 from flask_jwt_extended import JWTManager
 
-jwt = JWTManager(app)
+jwt = JWTManager()
 
 
 # Schemas Definition
@@ -38,38 +52,19 @@ class UtilisateurGETInputSchema(Schema):
     password = fields.Str(required=True)
 
 
-class UtilisateurGETOutputSchema(Schema):  # Similar to UtilisateurPOST schema
-    id = fields.Integer(required=True)
-    nom = fields.Str(required=True)
-    sexe = fields.Str(required=True)
-    dateNaissance = fields.Date(required=True)
-    email = fields.Email()
-    numeroTelephone = fields.Str()
-    province = fields.Str(required=True)
-    commune = fields.Str(required=True)
-    password = fields.Str(required=True)
-    access_token = fields.Str(required=True)
-    services = fields.Dict(keys=fields.Str(), values=fields.Str())
-
-
 class HopitalPOSTSchema(Schema):
     nom = fields.Str(required=True)
     adresse = fields.Str()
     services = fields.List(fields.Str())
 
 
-class HopitalGETOutputSchema(Schema):
-    hopitaux = fields.Dict(keys=fields.Str(),
-                           values=fields.List(fields.Str()))
-
-
-class RDVGETOutputSchema(Schema):
-    output = fields.List(
-            fields.Dict(
-                keys=fields.Str(),
-                values=fields.Raw()
-            )
-        )
+class RDVGETInputSchema(Schema):
+    id_user = fields.Integer(required=True)
+    start = fields.DateTime(data_key="from")
+    end = fields.DateTime(data_key="to")
+    limit = fields.Integer(load_default=RDV_PAGE_SIZE,
+                           validate=validate.Range(1, RDV_MAX_PAGE_SIZE))
+    cursor = fields.Str()
 
 
 class RDVPOSTSchema(Schema):
@@ -84,6 +79,12 @@ class RDVPOSTSchema(Schema):
     reference_id = fields.Integer()
 
 
+class DisponibiliteGETInputSchema(Schema):
+    hopital = fields.Str(required=True)
+    service = fields.Str(required=True)
+    date = fields.Date(required=True)
+
+
 class RDVPOST2Schema(Schema):
     nom = fields.Str(required=True)
     sexe = fields.Str(required=True)
@@ -94,276 +95,718 @@ class RDVPOST2Schema(Schema):
     reference_id = fields.Integer()
 
 
-# Resources definition
+# Schemas are stateless once built, so each one is instantiated only once
+user_post_schema = UtilisateurPOSTSchema()
+user_get_schema = UtilisateurGETInputSchema()
+hopital_post_schema = HopitalPOSTSchema()
+rdv_get_schema = RDVGETInputSchema()
+rdv_post_schema = RDVPOSTSchema()
+disponibilite_get_schema = DisponibiliteGETInputSchema()
+
+
+# Caches definition
+
+@primary
+def load_services() -> dict:
+    services: dict = {}
+    for service in db.session.execute(db.select(Service)).scalars():
+        services.update(service.to_dict())
+    return services
+
 
-class UtilisateurResource(Resource):
-    @retry(
-        retry=retry_if_not_exception_type((HTTPException)),
-        wait=wait_exponential(multiplier=1, min=2, max=5),
-        stop=stop_after_attempt(3)
-    )
-    def get(self):
+def select_hopitaux_services():
+    # Fully ordered, so that the snapshot bytes and its ETag only change
+    # with the data, never with the join plan
+    return db.select(Hopital.nom, Service.nom) \
+        .outerjoin(service_hopital,
+                   service_hopital.c.hopital_id == Hopital.id) \
+        .outerjoin(Service, service_hopital.c.service_id == Service.id) \
+        .order_by(Hopital.id, Service.nom)
+
+
+def build_hopitaux_snapshot(rows) -> tuple[bytes, str]:
+    """Serialized body of GET /hopital and its ETag, from the rows of
+    `select_hopitaux_services`"""
+    hopitaux_services: dict[str, list[str]] = {}
+    for hopital, service in rows:
+        services = hopitaux_services.setdefault(hopital, [])
+        if service is not None:
+            services.append(service.capitalize())
+    body = dumps({"hopitaux": hopitaux_services})
+    return body, sha256(body).hexdigest()
+
+
+@primary
+def load_hopitaux_snapshot() -> tuple[bytes, str]:
+    return build_hopitaux_snapshot(
+            db.session.execute(select_hopitaux_services()))
+
+
+@primary
+def load_ids() -> dict[str, dict[str, int]]:
+    """Maps the lowercased names of hopitaux and services to their ids"""
+    return {
+            "hopitaux": {nom.lower(): id for nom, id in db.session.execute(
+                db.select(Hopital.nom, Hopital.id))},
+            "services": {nom.lower(): id for nom, id in db.session.execute(
+                db.select(Service.nom, Service.id))}
+            }
+
+
+# Service catalog sent at login, invalidated when Hopitals.post commits
+services_catalog = TTLCache(load_services, SERVICES_CACHE_TTL)
+# Hospital directory of GET /hopital, invalidated when Hopitals.post commits
+hopitaux_snapshot = TTLCache(load_hopitaux_snapshot, HOPITAUX_CACHE_TTL)
+# Name to id resolution of RDVs.post, invalidated when Hopitals.post commits
+ids_map = TTLCache(load_ids, HOPITAUX_CACHE_TTL)
+
+
+@primary
+def load_bookings(key: tuple[int, int], since: datetime) -> list[datetime]:
+    hopital_id, service_id = key
+    return db.session.execute(
+            db.select(RDV.dateTime).where(RDV.hopital_id == hopital_id,
+                                          RDV.service_id == service_id,
+                                          RDV.dateTime >= since)
+            ).scalars().all()
+
+
+# Booked slots per (hopital_id, service_id), updated on every booking
+slot_index = SlotIndex(load_bookings, SLOT_DURATION, AVAILABILITY_TTL)
+
+
+def reset_caches():
+    """Empties the caches above, shared by every app of the process, so that
+    a new app never serves what was loaded from another app's database"""
+    services_catalog.invalidate()
+    hopitaux_snapshot.invalidate()
+    ids_map.invalidate()
+    slot_index.invalidate()
+    responses.clear()
+
+
+def select_ids(kind: str, noms: set[str]):
+    """Selects the (nom, id) of the hopitaux or services (`kind` being
+    "hopitaux" or "services") called `noms`, on the unique index of nom"""
+    model = Hopital if kind == "hopitaux" else Service
+    return db.select(model.nom, model.id).where(model.nom.in_(noms))
+
+
+def resolve_ids(kind: str, noms: set[str]) -> dict[str, int]:
+    """Ids of the hopitaux or services called `noms`, by lowercased name.
+
+    Names missing from the id map are looked up with a single indexed query,
+    in case another process added them, and the ones found are added to the
+    map. Misses are neither cached nor a reason to reload the map, so that
+    unknown names cost one cheap query and never evict it for the other
+    requests"""
+    known = ids_map.get()[kind]
+    missing = {nom for nom in noms if nom.lower() not in known}
+    if missing:
+        for nom, id in db.session.execute(select_ids(kind, missing)):
+            known[nom.lower()] = id
+    return {nom.lower(): known[nom.lower()] for nom in noms
+            if nom.lower() in known}
+
+
+def resolve_id(kind: str, nom: str) -> int | None:
+    """Id of the hopital or service called `nom`, see resolve_ids"""
+    return resolve_ids(kind, {nom}).get(nom.lower())
+
+
+# Metrics definition
+
+def pool_connections() -> dict:
+    pool = db.engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+    return {(("state", "checked_out"),): pool.checkedout(),
+            (("state", "idle"),): pool.checkedin(),
+            (("state", "overflow"),): max(pool.overflow(), 0)}
+
+
+def pool_saturation() -> dict:
+    pool = db.engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+    # The pool's own limit, whatever the engine was configured with; a
+    # negative max_overflow means the pool has no limit
+    capacity = pool.size() + pool._max_overflow
+    if pool._max_overflow < 0 or capacity <= 0:
+        return {}
+    return {(): pool.checkedout() / capacity}
+
+
+Gauge("medico_db_pool_connections",
+      "Connections of the database pool by state", pool_connections)
+Gauge("medico_db_pool_saturation",
+      "Checked out connections over the pool capacity", pool_saturation)
+Gauge("medico_db_retries_total",
+      "Retried and given up resource methods on transient database errors",
+      lambda: {(("method", method), ("outcome", outcome)): count
+               for (method, outcome), count in retry_counts.items()},
+      type="counter")
+
+
+# Helpers definition
+
+def import_hopitaux(hopitaux: list[dict],
+                    session=db.session) -> list[str | None]:
+    """Inserts already validated hopitaux and their services in a single
+    transaction: service names are resolved in one query, then the missing
+    services, the hopitaux and the service_hopital links are bulk inserted.
+
+    Returns, for each hopital, None if it was inserted or the reason why it
+    was skipped. `session` lets the async mode run it through run_sync"""
+    errors: list[str | None] = [None] * len(hopitaux)
+    existing = set(session.execute(
+        db.select(Hopital.nom).where(
+            Hopital.nom.in_([hopital["nom"] for hopital in hopitaux]))
+        ).scalars())
+    to_insert: list[dict] = []
+    for index, hopital in enumerate(hopitaux):
+        if hopital["nom"] in existing:
+            errors[index] = f"Hopital {hopital['nom']} already exists"
+            continue
+        existing.add(hopital["nom"])
+        to_insert.append(hopital)
+    if not to_insert:
+        return errors
+
+    service_names = {_service.strip().lower()
+                     for hopital in to_insert
+                     for _service in hopital.get("services", [])
+                     if _service.strip()}
+    service_ids: dict[str, int] = dict(session.execute(
+        db.select(Service.nom, Service.id).where(
+            Service.nom.in_(service_names))).all())
+    missing = service_names - service_ids.keys()
+    if missing:
+        session.execute(db.insert(Service),
+                           [{"nom": nom} for nom in sorted(missing)])
+        service_ids.update(session.execute(
+            db.select(Service.nom, Service.id).where(
+                Service.nom.in_(missing))).all())
+        logger.info("Added %d new services", len(missing))
+
+    session.execute(db.insert(Hopital), [
+        {"nom": hopital["nom"], "adresse": hopital.get("adresse", None)}
+        for hopital in to_insert])
+    hopital_ids: dict[str, int] = dict(session.execute(
+        db.select(Hopital.nom, Hopital.id).where(
+            Hopital.nom.in_([hopital["nom"] for hopital in to_insert]))
+        ).all())
+    links = {(service_ids[_service.strip().lower()],
+              hopital_ids[hopital["nom"]])
+             for hopital in to_insert
+             for _service in hopital.get("services", [])
+             if _service.strip()}
+    if links:
+        session.execute(service_hopital.insert(), [
+            {"service_id": service_id, "hopital_id": hopital_id}
+            for service_id, hopital_id in links])
+
+    session.commit()
+    services_catalog.invalidate()
+    hopitaux_snapshot.invalidate()
+    ids_map.invalidate()
+    return errors
+
+
+def validated(schema: Schema, location: str = "json",
+              message: str = "Invalid request"):
+    """Loads the request body (`location` "json") or query string ("args")
+    with `schema` and passes the result to the decorated resource method.
+    Invalid requests are answered with a 404 and `message`"""
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            data = request.get_json(silent=True) if location == "json" \
+                else request.args
+            try:
+                loaded = schema.load(data)
+            except ValidationError as e:
+                logger.error("Error when loading %s using %s (%s %s): %s",
+                             location, type(schema).__name__,
+                             request.method, request.path, e.messages)
+                return {"message": message}, 404
+            return method(self, loaded, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def load_batch(schema: Schema) -> tuple[list[dict], list[tuple[int, dict]]] | None:
+    """Loads the items of a JSON array or NDJSON request body with `schema`.
+
+    Returns the error results of the invalid items and the (index, item)
+    pairs of the valid ones, or None if the body is not a list"""
+    if request.mimetype == "application/x-ndjson":
+        payload = []
+        lines = request.get_data(as_text=True).splitlines()
+        for line in filter(str.strip, lines):
+            try:
+                payload.append(json.loads(line))
+            except ValueError as e:
+                payload.append(e)
+    else:
+        payload = request.get_json(silent=True)
+    if not isinstance(payload, list):
+        return None
+
+    results: list[dict] = []
+    valid: list[tuple[int, dict]] = []
+    for index, item in enumerate(payload):
         try:
-            user = UtilisateurGETInputSchema().load(request.args)
+            if isinstance(item, Exception):
+                raise item
+            valid.append((index, schema.load(item)))
+        except ValidationError as e:
+            results.append({"index": index, "status": "error",
+                            "message": e.messages})
         except Exception as e:
-            logger.error(f"Error when loading user using GET schema %s: {e}",
-                         "(GET /user)")
-            abort(404, message="User not provided correctly")
+            results.append({"index": index, "status": "error",
+                            "message": str(e)})
+    return results, valid
+
+
+def rebuild_creneaux() -> int:
+    """Recounts every creneau row from the RDVs with the current
+    SLOT_DURATION, in a single transaction, and returns the number of slots.
+
+    Needed after changing SLOT_MINUTES: rows built with another slot length
+    no longer line up with the slots of new bookings, whose capacity would
+    then ignore the earlier ones. Meant to run while no booking is made"""
+    counts = Counter(
+            (hopital_id, service_id, slot_start(dateTime, SLOT_DURATION))
+            for hopital_id, service_id, dateTime in db.session.execute(
+                db.select(RDV.hopital_id, RDV.service_id, RDV.dateTime)
+                .where(RDV.hopital_id.is_not(None),
+                       RDV.service_id.is_not(None))))
+    db.session.execute(db.delete(Creneau))
+    if counts:
+        db.session.execute(db.insert(Creneau), [
+            {"hopital_id": hopital_id, "service_id": service_id,
+             "debut": debut, "reservations": reservations}
+            for (hopital_id, service_id, debut), reservations
+            in counts.items()])
+    db.session.commit()
+    slot_index.invalidate()
+    return len(counts)
+
+
+def ensure_slots(slots: set[tuple[int, int, datetime]],
+                 session=db.session):
+    """Creates, and commits, the missing creneau rows of the given
+    (hopital_id, service_id, debut) slots. Must be called before the booking
+    transaction starts"""
+    for _ in range(3):
+        existing = set(session.execute(
+            Creneau.select_existing(slots)).tuples())
+        missing = slots - existing
+        if not missing:
+            return
+        try:
+            session.execute(db.insert(Creneau), [
+                {"hopital_id": hopital_id, "service_id": service_id,
+                 "debut": debut, "reservations": 0}
+                for hopital_id, service_id, debut in missing])
+            session.commit()
+            return
+        except IntegrityError:
+            # Another request created some of them first
+            session.rollback()
+    raise RuntimeError(f"Could not create the slots {slots}")
+
+
+def reserve_slot(slot: tuple[int, int, datetime], places: int,
+                 session=db.session) -> bool:
+    """Atomically takes `places` places of an existing slot in the current
+    transaction. Only the creneau row is locked, and only until the
+    transaction ends; returns False if the slot has not enough room left"""
+    return session.execute(
+            Creneau.reserve(slot, places, SLOT_CAPACITY)).rowcount == 1
+
+
+def register_user(user: dict, session=db.session) -> tuple[dict, int]:
+    """Registers an already validated user, shared by POST /user of both
+    apps. Returns the response body and status"""
+    email = user.get("email", "")
+    numeroTelephone = user.get("numeroTelephone", "")
+
+    if email == "" and numeroTelephone == "":
+        logger.warning("Nor 'email' nor 'numeroTelephone' was provided %s",
+                       "(POST /user)")
+        return {"message": "No contact info was provided"}, 404
+
+    if len(user["password"]) != 64:
+        logger.warning("Invalid password format %s", "(POST /user)")
+        return {"message": "Invalid password format"}, 404
+
+    # Checking if the given user doesn't exist
+    existing_user = session.execute(
+            db.select(Utilisateur.id).where(db.or_(
+                Utilisateur.email == email,
+                Utilisateur.numeroTelephone == numeroTelephone))
+            ).first()
+    if existing_user:
+        logger.info("User already exists %s", "(POST /user)")
+        return {"message": "User already exists"}, 403
+
+    session.add(Utilisateur(nom=user["nom"],
+                            sexe=user["sexe"],
+                            dateNaissance=user["dateNaissance"],
+                            email=email,
+                            numeroTelephone=numeroTelephone,
+                            province=user["province"],
+                            commune=user["commune"],
+                            password=user["password"]))
+    session.commit()
+    logger.info("Added user successfully")
+    return {"message": "User created successfully"}, 201
+
+
+def book_rdv(rdv: dict, hopital_id: int | None, service_id: int | None,
+             session=db.session) -> tuple[dict, int]:
+    """Books an already validated RDV, shared by POST /rdv of both apps:
+    `hopital_id` and `service_id` are resolved by the caller from its own id
+    map (None when not found). Returns the response body and status"""
+    if hopital_id is None:
+        logger.error("Hopital %s not found in DB - POST /rdv", rdv["hopital"])
+        return {"message": f"Hopital {rdv['hopital']} not found"}, 404
+    if service_id is None:
+        logger.error("Service %s not found in DB - POST /rdv", rdv["service"])
+        return {"message": f"Service {rdv['service']} not found"}, 404
+
+    user_id = rdv.get("reference_id")
+    user_exists = user_id is not None and session.execute(
+            db.select(Utilisateur.id).filter_by(id=user_id)
+            ).first() is not None
+    if not user_exists:
+        logger.error("User of id %s not found in DB - POST /rdv", user_id)
+        return {"message": f"User {user_id} not found"}, 404
+
+    # Taking a place in the slot, atomically with the insertion
+    slot = (hopital_id, service_id, slot_start(rdv["dateTime"], SLOT_DURATION))
+    ensure_slots({slot}, session)
+    if not reserve_slot(slot, 1, session):
+        session.rollback()
+        logger.warning("Slot %s is full - POST /rdv", slot)
+        return {"message": f"Slot {slot[2]} is full"}, 409
+
+    session.add(RDV(nom=rdv["nom"],
+                    sexe=rdv["sexe"],
+                    contact=rdv.get("contact", None),
+                    province=rdv.get("province", None),
+                    commune=rdv.get("commune", None),
+                    dateTime=rdv["dateTime"],
+                    hopital_id=hopital_id,
+                    service_id=service_id,
+                    utilisateur_id=user_id))
+    session.commit()  # A single transaction for the whole booking
+    logger.info("Inserted RDV successfully for user %s", user_id)
+    return {"message": "Inserted successfully"}, 201
+
+
+def book_rdvs(rdvs: list[dict]) -> list[str | None]:
+    """Inserts already validated RDVs with a single bulk insert and commit.
+
+    Hospitals and services are resolved from the id map (with one query per
+    kind for the names missing from it) and users with one query. Places are reserved
+    with one statement per distinct slot, falling back to one place at a
+    time when a slot cannot take all of its RDVs. Returns, for each RDV,
+    None if it was inserted or the reason why it was skipped"""
+    ids = {"hopitaux": resolve_ids("hopitaux",
+                                   {rdv["hopital"] for rdv in rdvs}),
+           "services": resolve_ids("services",
+                                   {rdv["service"] for rdv in rdvs})}
+    user_ids = {rdv["reference_id"] for rdv in rdvs if "reference_id" in rdv}
+    existing_users = set(db.session.execute(
+        db.select(Utilisateur.id).where(Utilisateur.id.in_(user_ids))
+        ).scalars()) if user_ids else set()
+
+    errors: list[str | None] = [None] * len(rdvs)
+    rows: dict[int, dict] = {}
+    for index, rdv in enumerate(rdvs):
+        hopital_id = ids["hopitaux"].get(rdv["hopital"].lower())
+        service_id = ids["services"].get(rdv["service"].lower())
+        user_id = rdv.get("reference_id")
+        if hopital_id is None:
+            errors[index] = f"Hopital {rdv['hopital']} not found"
+        elif service_id is None:
+            errors[index] = f"Service {rdv['service']} not found"
+        elif user_id not in existing_users:
+            errors[index] = f"User {user_id} not found"
+        else:
+            rows[index] = {"nom": rdv["nom"],
+                           "sexe": rdv["sexe"],
+                           "contact": rdv.get("contact", None),
+                           "province": rdv.get("province", None),
+                           "commune": rdv.get("commune", None),
+                           "dateTime": rdv["dateTime"],
+                           "hopital_id": hopital_id,
+                           "service_id": service_id,
+                           "utilisateur_id": user_id}
+    if not rows:
+        return errors
+
+    slots: dict[tuple, list[int]] = {}
+    for index, row in rows.items():
+        slot = (row["hopital_id"], row["service_id"],
+                slot_index.slot_start(row["dateTime"]))
+        slots.setdefault(slot, []).append(index)
+    ensure_slots(set(slots))
+    # Always in the same order, so that concurrent batches sharing slots
+    # cannot deadlock on their creneau rows
+    for slot in sorted(slots):
+        indexes = slots[slot]
+        if reserve_slot(slot, len(indexes)):
+            continue
+        for position, index in enumerate(indexes):
+            if not reserve_slot(slot, 1):
+                for full in indexes[position:]:
+                    errors[full] = f"Slot {slot[2]} is full"
+                    del rows[full]
+                break
+
+    if rows:
+        db.session.execute(db.insert(RDV), list(rows.values()))
+    db.session.commit()
+    for row in rows.values():
+        slot_index.add((row["hopital_id"], row["service_id"]),
+                       row["dateTime"])
+    return errors
+
+
+# The batch resources retry each batch on its own: retrying the whole
+# request would insert the batches already committed a second time
+retried_import_hopitaux = db_retry(import_hopitaux)
+retried_book_rdvs = db_retry(book_rdvs)
+
+
+# Resources definition
+
+class UtilisateurResource(Resource):
+    @validated(user_get_schema, "args", "User not provided correctly")
+    @read_only
+    @db_retry
+    def get(self, user):
 
         # Verifying if user provided email or numeroTelephone
-        email = user.get("email", "")
-        numeroTelephone = user.get("numeroTelephone", "")
-        if email == "" and numeroTelephone == "":
-            logger.warning(f"Nor 'email' nor 'numeroTelephone' was provided %s - provided user: {user}",
+        email = user.get("email")
+        numeroTelephone = user.get("numeroTelephone")
+        if not email and not numeroTelephone:
+            logger.warning("Nor 'email' nor 'numeroTelephone' was provided %s",
                            "(GET /user)")
             abort(404, message="No login info was provided")
 
         password = user.get("password")
         if not password:
-            logger.warning(f"Password not provided %s - provided user: {user}",
-                           "(GET /user)")
+            logger.warning("Password not provided %s", "(GET /user)")
             abort(403, message="Password not provided")
 
         password = hash_password(password)
 
-        existing_user_email: Utilisateur = Utilisateur.query.filter_by(email=email,
-                                                                       password=password).first()
-        existing_user_numeroTelephone: Utilisateur = Utilisateur.query.filter_by(
-                numeroTelephone=numeroTelephone,
-                password=password).first()
-
-        query_services: list[Service] = Service.query.all()
-        services: dict = {}
-        if query_services:
-            for service in query_services:
-                services.update(service.to_dict())
+        # A single statement on the unique indexes of the given identifiers
+        candidates: list[Utilisateur] = db.session.execute(
+                Utilisateur.select_login(email, numeroTelephone, password)
+                ).scalars().all()
+        existing_user: Utilisateur = Utilisateur.pick_login(candidates, email)
 
-        if existing_user_email:
-            access_token = create_access_token(identity=existing_user_email.get_identity(),
+        if existing_user:
+            services: dict = services_catalog.get()
+            access_token = create_access_token(identity=existing_user.get_identity(),
                                                expires_delta=None)
-            logger.info(f"Generated access token: {access_token}")
-            _result = existing_user_email.to_dict(access_token)
+            logger.debug("Generated access token for user %s",
+                         existing_user.id)
+            _result = existing_user.to_dict(access_token)
             _result['services'] = services
-            result = UtilisateurGETOutputSchema().dumps(_result)
-            logger.info("User gave email and was granted access")
-            return result, 200
-        elif existing_user_numeroTelephone:
-            access_token = create_access_token(
-                    identity=existing_user_numeroTelephone.get_identity(),
-                    expires_delta=None)
-            logger.info(f"Generated access token: {access_token}")
-            _result = existing_user_numeroTelephone.to_dict(access_token)
-            _result['services'] = services
-            result = UtilisateurGETOutputSchema().dumps(_result)
-            logger.info("User gave numeroTelephone and was granted access")
-            return result, 200
+            if email and existing_user.email == email:
+                logger.info("User gave email and was granted access")
+            else:
+                logger.info("User gave numeroTelephone and was granted access")
+            return json_response(_result, 200)
         else:
             abort(403, message="Access denied")
 
-    @retry(
-        retry=retry_if_not_exception_type((HTTPException)),
-        wait=wait_exponential(multiplier=1, min=2, max=5),
-        stop=stop_after_attempt(3)
-    )
-    def post(self):
-        try:
-            user = UtilisateurPOSTSchema().load(request.json)
-        except Exception as e:
-            logger.error(f"Error when loading user using POST schema %s: {e}",
-                         "(POST /user)")
-            abort(404, message="User not provided correctly")
-
-        email = user.get("email", "")
-        numeroTelephone = user.get("numeroTelephone", "")
-
-        if email == "" and numeroTelephone == "":
-            logger.warning(f"Nor 'email' nor 'numeroTelephone' was provided %s - provided user: {user}",
-                           "(POST /user)")
-            abort(404, message="No contact info was provided")
-
-        password = user.get("password")
-        if len(password) != 64:
-            logger.warning(f"Invalid password {password} - provided user %s: {user}",
-                           "(POST /user)")
-            abort(404, message="Invalid password format")
-
-        # Checking if the given user doesn't exist
-
-        existing_user = Utilisateur.query.filter_by(email=email).first()
-        existing_user2 = Utilisateur.query.filter_by(
-                numeroTelephone=numeroTelephone).first()
-
-        if existing_user or existing_user2:
-            logger.info(f"User already exists - provided user: {user}")
-            abort(403, message="User already exists")
-
-        # Adding new user
-        new_user = Utilisateur(nom=user["nom"],
-                               sexe=user["sexe"],
-                               dateNaissance=user["dateNaissance"],
-                               email=email,
-                               numeroTelephone=numeroTelephone,
-                               province=user["province"],
-                               commune=user["commune"],
-                               password=user["password"]
-                               )
-        db.session.add(new_user)
-        db.session.commit()
-        logger.info("Added user successfully")
-        return {"message": "User created successfully"}, 201
+    @validated(user_post_schema, message="User not provided correctly")
+    @idempotent
+    @db_retry
+    def post(self, user):
+        return register_user(user)
 
 
 class Hopitals(Resource):
 
-    @retry(
-        retry=retry_if_not_exception_type((HTTPException)),
-        wait=wait_exponential(multiplier=1, min=2, max=5),
-        stop=stop_after_attempt(3)
-    )
+    @read_only
+    @db_retry
     def get(self):
-        hopitaux: list[Hopital] = db.session.query(Hopital).all()
-        hopitaux_services = {}
-        for hopital in hopitaux:
-            _services: list[Service] = hopital.services
-            services: list[str] = list(map(
-                lambda x: x.nom.capitalize(), _services))
-            hopitaux_services.update({hopital.nom: services})
-        dumped = HopitalGETOutputSchema().dump({"hopitaux": hopitaux_services})
-        return dumped, 200
-
-    @retry(
-        retry=retry_if_not_exception_type((HTTPException)),
-        wait=wait_exponential(multiplier=1, min=2, max=5),
-        stop=stop_after_attempt(3)
-    )
-    def post(self):
-        try:
-            hopital = HopitalPOSTSchema().load(request.json)
-        except Exception as e:
-            logger.error(
-                    f"Error when loading hopital using POST schema %s: {e}",
-                    "(POST /hopital)")
-            abort(404, message="Hopital not provided correctly")
+        body, etag = hopitaux_snapshot.get()
+        response = Response(body, status=200, mimetype="application/json")
+        response.set_etag(etag)
+        # Answers 304 Not Modified when If-None-Match carries the ETag
+        return response.make_conditional(request)
+
+    @validated(hopital_post_schema, message="Hopital not provided correctly")
+    @idempotent
+    @db_retry
+    def post(self, hopital):
 
-        adresse = hopital.get('adresse', None)
         try:
-            new_hopital = Hopital(nom=hopital['nom'],
-                                  adresse=adresse)
-            db.session.add(new_hopital)
-            db.session.commit()
+            errors = import_hopitaux([hopital])
         except Exception as e:
-            logger.error(f"Could not add hopital '{hopital}': {e}")
+            db.session.rollback()
+            if is_transient(e):
+                raise
+            errors = [str(e)]
+        if errors[0]:
+            logger.error("Could not add hopital '%s': %s", hopital['nom'],
+                         errors[0])
             return {"message": "Invalid request"}, 404
 
-        services: list[str] = hopital['services']
-        for _service in services:
-            _service = _service.strip()
-            service: Service
-            try:
-                service = db.session.execute(db.select(Service).filter_by(
-                    nom=_service.lower())).scalar_one()
-            except Exception:
-                logger.warning(f"No service '{_service}' found in DB")
-                service = Service(nom=_service.lower())
-                db.session.add(service)
-                db.session.commit()
-                logger.info(f"Added new service '{_service}'")
-
-            new_hopital.services.append(service)
-            logger.info(f"Added service {service} to hopital {new_hopital}")
-
-        db.session.commit()
-        logger.info(f"Added hopital '{new_hopital.to_dict()}' successfully")
+        logger.info("Added hopital '%s' successfully", hopital['nom'])
         return {"message": "Hopital inserted successfully"}, 201
 
 
+class HopitalsBatch(Resource):
+    """Imports many hopitaux at once from a JSON array or NDJSON upload,
+    committing once per HOPITAL_BATCH_SIZE hopitaux"""
+
+    @idempotent
+    def post(self):
+        loaded = load_batch(hopital_post_schema)
+        if loaded is None:
+            logger.error("Hopitaux batch is not a list %s", "(POST /hopital/batch)")
+            return {"message": "Invalid request"}, 404
+        results, valid = loaded
+
+        for start in range(0, len(valid), HOPITAL_BATCH_SIZE):
+            batch = valid[start:start + HOPITAL_BATCH_SIZE]
+            try:
+                errors = retried_import_hopitaux(
+                        [hopital for _, hopital in batch])
+            except Exception as e:
+                db.session.rollback()
+                if is_transient(e):
+                    raise
+                logger.error("Could not import hopitaux batch: %s", e)
+                errors = ["Could not insert the batch"] * len(batch)
+            for (index, hopital), error in zip(batch, errors):
+                result = {"index": index, "nom": hopital["nom"],
+                          "status": "error" if error else "created"}
+                if error:
+                    result["message"] = error
+                results.append(result)
+
+        results.sort(key=lambda result: result["index"])
+        created = sum(result["status"] == "created" for result in results)
+        logger.info("Imported %d/%d hopitaux", created, len(results))
+        status = 201 if created == len(results) else 207
+        return {"created": created, "results": results}, status
+
+
 class RDVs(Resource):
-    @retry(
-        retry=retry_if_not_exception_type((HTTPException)),
-        wait=wait_exponential(multiplier=1, min=2, max=5),
-        stop=stop_after_attempt(3)
-    )
-    def get(self):
-        id_user = request.args.get("id_user", "")
-        if id_user == "":
+    @validated(rdv_get_schema, "args")
+    @read_only
+    @db_retry
+    def get(self, params):
+        try:
+            after = decode_cursor(params["cursor"]) \
+                if "cursor" in params else None
+        except ValueError as e:
+            logger.error("Invalid cursor %s: %s", "(GET /rdv)", e)
             return {"message": "Invalid request"}, 404
-        id_user = int(id_user)
-        user = Utilisateur.query.filter_by(id=id_user).first()
-        rdv_for_user: list[RDV] = user.rdv
-        response: list[dict] = []
-        for _rdv in rdv_for_user:
-            response.append(_rdv.to_dict())
-
-        json_response = RDVGETOutputSchema().dumps({"output": response})
-        return json_response, 200
-
-    @retry(
-        retry=retry_if_not_exception_type((HTTPException)),
-        wait=wait_exponential(multiplier=1, min=2, max=5),
-        stop=stop_after_attempt(3)
-    )
+
+        # One statement per page whatever the size of the history
+        limit = params["limit"]
+        rows = db.session.execute(RDV.select_for_user(
+            params["id_user"], start=params.get("start"),
+            end=params.get("end"), after=after, limit=limit)).all()
+        response: list[dict] = [RDV.row_to_dict(row) for row in rows]
+
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = encode_cursor(rows[-1].dateTime, rows[-1].id)
+
+        return json_response({"output": response,
+                              "next_cursor": next_cursor}, 200)
+
+    @validated(rdv_post_schema)
+    @idempotent
+    @db_retry
+    def post(self, rdv):
+        logger.debug("Payload %s: %s", "(POST /rdv)", rdv)
+
+        # Resolving the hospital and the service from the in-memory id map
+        hopital_id = resolve_id("hopitaux", rdv['hopital'])
+        service_id = resolve_id("services", rdv['service']) \
+            if hopital_id is not None else None
+        result = book_rdv(rdv, hopital_id, service_id)
+        if result[1] == 201:
+            slot_index.add((hopital_id, service_id), rdv['dateTime'])
+        return result
+
+
+class RDVsBatch(Resource):
+    """Books many RDVs at once from a JSON array or NDJSON upload,
+    committing once per RDV_BATCH_SIZE RDVs"""
+
+    @idempotent
     def post(self):
-        logger.debug(request.json)
-        try:
-            rdv = RDVPOSTSchema().load(request.json)
-        except Exception as e:
-            logger.error(
-                    f"Error when loading rdv POST schema %s: {e}",
-                    "(POST /rdv)")
+        loaded = load_batch(rdv_post_schema)
+        if loaded is None:
+            logger.error("RDVs batch is not a list %s", "(POST /rdv/batch)")
             return {"message": "Invalid request"}, 404
+        results, valid = loaded
 
-        contact = rdv.get("contact", None)
-        province = rdv.get("province", None)
-        commune = rdv.get("commune", None)
-        _rdv = RDV(nom=rdv['nom'],
-                   sexe=rdv['sexe'],
-                   contact=contact,
-                   province=province,
-                   commune=commune,
-                   dateTime=rdv['dateTime'],
-                   )
-        db.session.add(_rdv)
-
-        # Searching for the corresponding Hospital
-        _hopital = rdv['hopital']
-        hospital = Hopital.query.filter_by(
-                nom=_hopital).first()
-        if not hospital:
-            logger.error(f"Hopital {_hopital} not found in DB - POST /rdv")
-            return {"message": f"Hopital {_hopital} not found"}, 404
-
-        # Searching for the corresponding Service
-        _service = rdv['service']
-        service = Service.query.filter_by(
-                nom=_service).first()
-        if not service:
-            logger.error(f"Service {_service} not found in DB - POST /rdv")
-            return {"message": f"Service {_service} not found"}, 404
-
-        # Searching for the corresponding Utilisateur
-        _userID = rdv['reference_id']
-        user = Utilisateur.query.filter_by(
-                id=_userID).first()
-        if not user:
-            logger.error(f"User of id {_userID} not found in DB - POST /rdv")
-            return {"message": f"User {_userID} not found"}, 404
-
-        db.session.commit()  # Writing the changes to add the RDV
-        _rdv.reference = user
-        _rdv.hopital = hospital
-        _rdv.service = service
-
-        db.session.commit()  # Writing the changes to the foreign keys
-        logger.info(f"Inserted RDV successfully {_rdv.to_dict()}")
-
-        return {"message": "Inserted successfully"}, 201
+        for start in range(0, len(valid), RDV_BATCH_SIZE):
+            batch = valid[start:start + RDV_BATCH_SIZE]
+            try:
+                errors = retried_book_rdvs([rdv for _, rdv in batch])
+            except Exception as e:
+                db.session.rollback()
+                if is_transient(e):
+                    raise
+                logger.error("Could not book RDVs batch: %s", e)
+                errors = ["Could not insert the batch"] * len(batch)
+            for (index, rdv), error in zip(batch, errors):
+                result = {"index": index,
+                          "status": "error" if error else "created"}
+                if error:
+                    result["message"] = error
+                results.append(result)
+
+        results.sort(key=lambda result: result["index"])
+        created = sum(result["status"] == "created" for result in results)
+        logger.info("Booked %d/%d RDVs", created, len(results))
+        status = 201 if created == len(results) else 207
+        return {"created": created, "results": results}, status
+
+
+class Disponibilites(Resource):
+    @validated(disponibilite_get_schema, "args")
+    @read_only
+    @db_retry
+    def get(self, query):
+
+        hopital_id = resolve_id("hopitaux", query["hopital"])
+        if hopital_id is None:
+            return {"message": f"Hopital {query['hopital']} not found"}, 404
+        service_id = resolve_id("services", query["service"])
+        if service_id is None:
+            return {"message": f"Service {query['service']} not found"}, 404
+
+        query["slots"] = slot_index.free_slots((hopital_id, service_id),
+                                               query["date"], OPENING_TIME,
+                                               CLOSING_TIME, SLOT_CAPACITY)
+        return json_response(query, 200)
 
 
 class Test(Resource):
     @jwt_required()
     def get(self):
         username = get_jwt_identity()
-        logger.info(f"User '{username}' is accessing a protected route")
+        logger.info("User '%s' is accessing a protected route", username)
         v = {"message": f"{username} connected"}
         return v, 200
 
@@ -371,3 +814,9 @@ class Test(Resource):
 class Home(Resource):
     def get(self):
         return {"message": "medico api"}
+
+
+class Metrics(Resource):
+    def get(self):
+        return Response(render_metrics(), status=200,
+                        mimetype="text/plain; version=0.0.4")
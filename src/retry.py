@@ -0,0 +1,96 @@
+import asyncio
+from collections import Counter
+from functools import wraps
+from threading import Lock
+import random
+import time
+
+from sqlalchemy.exc import DBAPIError
+
+from .models.models import db
+from .models.init import logger, DB_RETRY_ATTEMPTS, DB_RETRY_BUDGET
+
+# MySQL errors worth retrying: server gone away, lost connection,
+# lock wait timeout and deadlock
+TRANSIENT_MYSQL_ERRORS = {2006, 2013, 1205, 1213}
+
+# Number of retries and give ups per resource method
+retry_counts: Counter = Counter()
+_counts_lock = Lock()
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether `error` is a database error that may not happen again"""
+    if not isinstance(error, DBAPIError):
+        return False
+    if error.connection_invalidated:
+        return True
+    args = getattr(error.orig, "args", ())
+    if args and args[0] in TRANSIENT_MYSQL_ERRORS:
+        return True
+    return "database is locked" in str(error.orig)
+
+
+def _count(name: str, outcome: str):
+    with _counts_lock:
+        retry_counts[(name, outcome)] += 1
+
+
+def _give_up(name: str, attempt: int, start: float, error: DBAPIError,
+             delay: float) -> bool:
+    """Whether to stop retrying after `error`, logged and counted for
+    transient errors"""
+    if not is_transient(error):
+        return True
+    if attempt == DB_RETRY_ATTEMPTS \
+            or time.monotonic() - start + delay > DB_RETRY_BUDGET:
+        _count(name, "gave_up")
+        logger.error("%s gave up after %d attempts: %s", name, attempt,
+                     error)
+        return True
+    _count(name, "retried")
+    logger.warning("%s failed on attempt %d, retrying: %s", name, attempt,
+                   error)
+    return False
+
+
+def db_retry(method):
+    """Retries `method` on transient database errors only, rolling the
+    session back between attempts. Gives up after DB_RETRY_ATTEMPTS attempts
+    or once the next attempt would start after DB_RETRY_BUDGET seconds;
+    every other exception goes through untouched"""
+    name = method.__qualname__
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.monotonic()
+        for attempt in range(1, DB_RETRY_ATTEMPTS + 1):
+            try:
+                return method(*args, **kwargs)
+            except DBAPIError as e:
+                db.session.rollback()
+                delay = random.uniform(0, 0.05 * 2 ** attempt)
+                if _give_up(name, attempt, start, e, delay):
+                    raise
+                time.sleep(delay)
+    return wrapper
+
+
+def async_db_retry(handler):
+    """db_retry for the handlers of the async mode, called with the request
+    and the AsyncSession to roll back between attempts"""
+    name = handler.__qualname__
+
+    @wraps(handler)
+    async def wrapper(request, session):
+        start = time.monotonic()
+        for attempt in range(1, DB_RETRY_ATTEMPTS + 1):
+            try:
+                return await handler(request, session)
+            except DBAPIError as e:
+                await session.rollback()
+                delay = random.uniform(0, 0.05 * 2 ** attempt)
+                if _give_up(name, attempt, start, e, delay):
+                    raise
+                await asyncio.sleep(delay)
+    return wrapper
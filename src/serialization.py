@@ -0,0 +1,38 @@
+from datetime import date, datetime
+import json
+
+from flask import Response
+
+try:  # Optional, several times faster than the standard library
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ", timespec="seconds")
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(value) -> bytes:
+        """Serializes `value` to JSON bytes, datetimes being written as
+        "%Y-%m-%d %H:%M:%S" and dates as "%Y-%m-%d" """
+        return orjson.dumps(value, default=_default,
+                            option=orjson.OPT_PASSTHROUGH_DATETIME)
+else:
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False,
+                                separators=(",", ":"))
+
+    def dumps(value) -> bytes:
+        """Serializes `value` to JSON bytes, datetimes being written as
+        "%Y-%m-%d %H:%M:%S" and dates as "%Y-%m-%d" """
+        return _encoder.encode(value).encode()
+
+
+def json_response(value, status: int = 200) -> Response:
+    """Response whose body is `value` serialized once, straight to bytes"""
+    return Response(dumps(value), status=status, mimetype="application/json")
@@ -0,0 +1,117 @@
+"""Debug mode of the SQL layer, for development and staging: logs the N+1
+suspects of every request and the slow statements with their plan. Enabled
+by SQL_DEBUG, it costs a stack walk per statement."""
+from collections import Counter
+import os
+import re
+import time
+import traceback
+
+from flask import Flask, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from .functions import resource_method
+from .models.init import logger, N_PLUS_ONE_THRESHOLD, SLOW_QUERY_SECONDS
+
+SOURCE_DIR = os.path.dirname(__file__)
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLACEHOLDER = r"\s*(?:\?|%s|:\w+)\s*"
+PLACEHOLDER_LISTS = re.compile(rf"\((?:{PLACEHOLDER},)+{PLACEHOLDER}\)")
+EXPLAINABLE = ("SELECT", "UPDATE", "DELETE")
+
+
+def fingerprint(statement: str) -> str:
+    """Shape of `statement`: literals and lists of placeholders are
+    collapsed, so that the statements of a loop all share it"""
+    shape = LITERALS.sub("?", statement)
+    shape = PLACEHOLDER_LISTS.sub("(?, ...)", shape)
+    return " ".join(shape.split())
+
+
+def _origin() -> str:
+    """Innermost line of the app's own code on the stack"""
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename.startswith(SOURCE_DIR) \
+                and frame.filename != __file__:
+            return f"{os.path.relpath(frame.filename, SOURCE_DIR)}:" \
+                   f"{frame.lineno} ({frame.name})"
+    return "unknown"
+
+
+def _explain(conn, statement: str, parameters) -> str:
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" \
+        else "EXPLAIN "
+    # Straight on the DBAPI connection, so that the EXPLAIN is neither
+    # seen by the engine events nor part of the ORM's transaction state
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return "\n".join(" | ".join(str(value) for value in row)
+                         for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if context is not None:
+        context._debug_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    start = getattr(context, "_debug_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    in_request = has_request_context() and "sql_shapes" in g
+
+    if in_request:
+        shape = fingerprint(statement)
+        g.sql_shapes[shape] += 1
+        if shape not in g.sql_origins:
+            g.sql_origins[shape] = _origin()
+
+    if elapsed >= SLOW_QUERY_SECONDS:
+        where = f"in {resource_method()}" if in_request \
+            else "outside a request"
+        if executemany:
+            plan = "not available for executemany"
+        elif statement.lstrip()[:6].upper() not in EXPLAINABLE:
+            plan = "not available for this statement"
+        else:
+            try:
+                plan = _explain(conn, statement, parameters)
+            except Exception as e:
+                plan = f"EXPLAIN failed: {e}"
+        logger.warning("Slow statement (%.3fs) %s, at %s: %s\nPlan:\n%s",
+                       elapsed, where, _origin(), " ".join(statement.split()),
+                       plan)
+
+
+def _start_request():
+    g.sql_shapes = Counter()
+    g.sql_origins = {}
+
+
+def _report_request(response):
+    if "sql_shapes" in g:
+        for shape, count in g.sql_shapes.items():
+            if count >= N_PLUS_ONE_THRESHOLD:
+                logger.warning("N+1 suspect in %s: %d statements shaped %s, "
+                               "first from %s", resource_method(), count,
+                               shape, g.sql_origins[shape])
+    return response
+
+
+def enable_sql_debug(app: Flask):
+    if not event.contains(Engine, "after_cursor_execute",
+                          _after_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_report_request)
+    logger.warning("SQL debug mode enabled: N+1 threshold %d, slow "
+                   "statements from %.3fs", N_PLUS_ONE_THRESHOLD,
+                   SLOW_QUERY_SECONDS)